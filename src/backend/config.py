@@ -13,6 +13,28 @@ class Config:
             "download_path": "./Music",
             "filename_template": "$title$ - $artist$",
             "cover_mode": "crop",  # crop, stretch,
+            "analyze_loudness": False,  # EBU R128 loudness + ReplayGain tags, measured while transcoding
+            "stream_downloads": True,  # pipe the audio stream into ffmpeg instead of writing a temp file
+            "cover_sizes": [64, 128, 640],  # sizes kept in the cover cache
+            "cover_format": "jpeg",  # ["jpeg","webp"]
+            "cover_quality": 85,
+            "embed_cover_size": 640,
+            "embed_cover_quality": 90,
+            "download_retries": 3,  # extra attempts for network errors and other transient failures
+            "unavailable_ttl_hours": 168,  # private/removed/blocked tracks are skipped by syncs for this long
+            "library_flush_ms": 500,  # library changes are written at most this often...
+            "library_flush_mutations": 200,  # ...or after this many changes
+            "cache_budget_mb": 512,  # cover cache size the garbage collector evicts unreferenced covers down to
+            "gc_interval_minutes": 30,
+            "gc_temp_max_age_hours": 6,
+            "gc_remove_deleted_tracks": False,  # delete files of tracks removed from their playlist upstream
+            "gc_removed_grace_hours": 24,
+            "generate_waveforms": True,  # peak files for waveform display, taken from the transcode
+            "preview_length": 15,  # seconds
+            "preview_memory_cache_mb": 32,
+            "preview_disk_cache_mb": 256,
+            "max_bytes_per_second": 0,  # download bandwidth shared by all workers, 0 = unlimited
+            "max_requests_per_second": 0,  # requests to YouTube shared by all workers, 0 = unlimited
             "max_threads":8
         }
     }
@@ -47,6 +69,11 @@ class Config:
             self._config = self.DEFAULTS.copy()
             self.save()
 
+    def reload(self) -> None:
+        """Re-read the configuration from disk, keeping defaults for missing keys."""
+        self.load()
+        self._ensure_defaults()
+
     def save(self) -> None:
         """Safely save configuration to disk (atomic write when possible)."""
         if not self._config:
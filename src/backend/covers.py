@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+from typing import Optional
+from PIL import Image
+import backend.helper_functions as helper_functions
+
+FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+}
+
+
+class CoverCache:
+    """Content addressed cache of square cover thumbnails in several sizes.
+
+    Every cover is stored as <cache_path>/covers/<cover_id>/<size>.<ext>, plus one JPEG copy
+    used as embedded art (mp3/m4a/ogg tags only accept JPEG or PNG) and a `mode` file holding the cover mode
+    the sizes were derived with. Covers cached before the mode file existed count as "crop".
+    """
+
+    def __init__(self, cache_path: str = None, sizes: list = None, image_format: str = "jpeg", quality: int = 85,
+                 embed_size: int = 640, embed_quality: int = 90):
+        if cache_path is None:
+            raise ValueError("No cache path was given!")
+        if image_format not in FORMATS:
+            raise ValueError(f"Invalid cover format, {image_format} is not supported!")
+        self.folder = os.path.join(cache_path, "covers")
+        self.sizes = sorted(set(sizes or [64, 128, 640]))
+        self.image_format = image_format
+        self.quality = int(quality)
+        self.embed_size = int(embed_size)
+        self.embed_quality = int(embed_quality)
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _cover_folder(self, cover_id: str) -> str:
+        return os.path.join(self.folder, cover_id)
+
+    def _embed_file(self, cover_id: str) -> str:
+        return os.path.join(self._cover_folder(cover_id), f"embed_{self.embed_size}.jpg")
+
+    def _size_file(self, cover_id: str, size: int) -> str:
+        return os.path.join(self._cover_folder(cover_id), f"{size}.{FORMATS[self.image_format][1]}")
+
+    def _mode_file(self, cover_id: str) -> str:
+        return os.path.join(self._cover_folder(cover_id), "mode")
+
+    def _mode(self, cover_id: str) -> str:
+        try:
+            with open(self._mode_file(cover_id), "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return "crop"
+
+    def _write(self, path: str, save: callable) -> None:
+        """Write through a temp file in the same folder, workers adding the same cover never see half written files."""
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(tmp_fd, "wb") as f:
+                save(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def has(self, cover_id: str = None, mode: str = None) -> bool:
+        """Whether every size of a cover is cached, and with a mode given, whether they were derived with it."""
+        if not cover_id:
+            return False
+        return all(os.path.exists(self._size_file(cover_id, size)) for size in self.sizes) \
+            and os.path.exists(self._embed_file(cover_id)) and (mode is None or self._mode(cover_id) == mode)
+
+    def add(self, source_path: str = None, cover_id: str = None, mode: str = "crop") -> str:
+        """Decode a source image once and derive every cached size from it. Returns the cover id.
+        A cover cached with another mode is derived again."""
+        if source_path is None or not os.path.exists(source_path):
+            raise FileNotFoundError("Cover image does not exist!")
+        if cover_id is None:
+            cover_id = helper_functions.hash_file(source_path)
+        if self.has(cover_id, mode=mode):
+            # Counts as a use, the garbage collector spares recently used covers
+            self._touch(cover_id)
+            return cover_id
+
+        largest = max(self.sizes + [self.embed_size])
+        with Image.open(source_path) as image:
+            # JPEG sources are downscaled by the decoder itself (never below the requested size)
+            image.draft("RGB", (largest, largest))
+            image = image.convert("RGB")
+        image = helper_functions.square_image(image, mode=mode)
+
+        os.makedirs(self._cover_folder(cover_id), exist_ok=True)
+        image_format = FORMATS[self.image_format][0]
+        master = image.resize((largest, largest), Image.Resampling.LANCZOS) if image.size[0] != largest else image
+        embed = master.resize((self.embed_size, self.embed_size), Image.Resampling.LANCZOS)
+        self._write(self._embed_file(cover_id), lambda f: embed.save(f, "JPEG", quality=self.embed_quality, optimize=True))
+        # Each size is scaled down from the previous one so the big resample only happens once
+        current = master
+        for size in reversed(self.sizes):
+            if current.size[0] != size:
+                current = current.resize((size, size), Image.Resampling.LANCZOS)
+            self._write(self._size_file(cover_id, size), lambda f, image=current: image.save(f, image_format, quality=self.quality))
+        # Written last, so an interrupted add() doesn't leave the new mode on old sizes
+        self._write(self._mode_file(cover_id), lambda f: f.write(mode.encode("utf-8")))
+        return cover_id
+
+    def _touch(self, cover_id: str) -> None:
+        # The folder mtime is the last use, the garbage collector evicts the least recently used covers first
+        try:
+            os.utime(self._cover_folder(cover_id))
+        except OSError:
+            pass
+
+    def entries(self) -> list:
+        """(cover id, bytes on disk, last use) of every cached cover."""
+        result = []
+        for cover_id in os.listdir(self.folder):
+            folder = self._cover_folder(cover_id)
+            try:
+                size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+                result.append((cover_id, size, os.path.getmtime(folder)))
+            except (FileNotFoundError, NotADirectoryError):
+                continue  # not a cover folder, or removed meanwhile
+        return result
+
+    def get(self, cover_id: str = None, size: int = 128) -> Optional[str]:
+        """Path of the smallest cached size that is at least `size` pixels (or the largest one)."""
+        if not self.has(cover_id):
+            return None
+        self._touch(cover_id)
+        for cached_size in self.sizes:
+            if cached_size >= size:
+                return self._size_file(cover_id, cached_size)
+        return self._size_file(cover_id, self.sizes[-1])
+
+    def embed_path(self, cover_id: str = None) -> Optional[str]:
+        """Path of the JPEG that gets embedded into audio files."""
+        if not self.has(cover_id):
+            return None
+        self._touch(cover_id)
+        return self._embed_file(cover_id)
+
+    def remove(self, cover_id: str = None) -> None:
+        if cover_id and os.path.isdir(self._cover_folder(cover_id)):
+            shutil.rmtree(self._cover_folder(cover_id))
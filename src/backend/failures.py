@@ -0,0 +1,56 @@
+import random
+import subprocess
+import time
+import requests
+from yt_dlp.utils import DownloadError, ExtractorError
+
+TRANSIENT = "transient"  # worth retrying soon: network trouble, throttling, expired stream urls, cut off encodes
+PERMANENT = "permanent"  # the track itself can't be had: private, removed, blocked, ...
+ERROR = "error"  # anything else (bad config, bugs), neither retried nor remembered
+
+# Lower case fragments of the messages YouTube throttles with. They come wrapped in permanent sounding ones
+# ("Video unavailable. This content isn't available, try again later."), so they are checked first.
+RATE_LIMITED = ["try again later", "rate-limited", "rate limited", "too many requests", "http error 429"]
+# reason -> lower case fragments of the error messages yt-dlp gives for it
+PERMANENT_REASONS = {
+    "private": ["private video", "this video is private"],
+    "region_blocked": ["not available in your country", "blocked it in your country", "not made this video available in your country"],
+    "age_restricted": ["sign in to confirm your age", "age-restricted"],
+    "members_only": ["members-only", "join this channel to get access"],
+    "copyright": ["copyright claim", "copyright grounds"],
+    "removed": ["this video has been removed", "this video is no longer available", "account associated with this video has been terminated",
+                "this video does not exist"],
+}
+
+
+def classify(error: BaseException):
+    """(kind, reason) of a download failure, kind being TRANSIENT, PERMANENT or ERROR."""
+    message = str(error).lower()
+    if any(fragment in message for fragment in RATE_LIMITED):
+        return TRANSIENT, "rate_limited"
+    for reason, fragments in PERMANENT_REASONS.items():
+        if any(fragment in message for fragment in fragments):
+            return PERMANENT, reason
+    if isinstance(error, (DownloadError, ExtractorError, requests.RequestException, subprocess.CalledProcessError, OSError)) \
+            and not isinstance(error, (FileNotFoundError, FileExistsError, PermissionError)):
+        return TRANSIENT, type(error).__name__
+    return ERROR, type(error).__name__
+
+
+def backoff_delay(attempt: int, base_delay: float = 2.0, max_delay: float = 60.0) -> float:
+    """Exponential backoff with full jitter, so workers that failed together don't retry together."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def with_retries(func: callable, attempts: int = 3, base_delay: float = 2.0, max_delay: float = 60.0):
+    """Call func, retrying it up to `attempts` more times while it fails with a transient error."""
+    for attempt in range(attempts + 1):
+        try:
+            return func()
+        except Exception as e:
+            kind, _ = classify(e)
+            if kind != TRANSIENT or attempt == attempts:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Transient failure ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
@@ -2,28 +2,47 @@ import os
 import uuid
 import json
 import math
+import time
 
 import backend.config as config
+import backend.covers as covers
+import backend.failures as failures
+import backend.garbage as garbage
+import backend.governor as governor
 import backend.helper_functions as helper_functions
 import backend.library as library
+import backend.migration as migration
+import backend.previews as previews
+import backend.relayout as relayout
+import backend.retag as retag
+import concurrent.futures
 import backend.threader as threader
+import backend.waveforms as waveforms
+import backend.services.provider as provider
 import backend.services.youtube as youtube
 from backend.services.youtube import check_network
 
 
 class Backend():
     def __init__(self):
+        self.configInstance = config.Config()
         self.set_constants()
 
-        self.libraryInstance = library.Library(filepath=self.DOWNLOAD_FOLDER)
-        self.youtubeInstance = youtube.YouTube()
+        self.libraryInstance = self.create_library()
+        self.governor = governor.Governor(bytes_per_second=self.MAX_BYTES_PER_SECOND, requests_per_second=self.MAX_REQUESTS_PER_SECOND)
+        self.youtubeInstance = youtube.YouTube(governor=self.governor)
+        self.trackResolver = provider.TrackResolver(target=self.youtubeInstance, cache_file=os.path.join(self.CACHE_PATH, "match_cache.json"))
+        self.previewService = self.create_preview_service()
         self.threadingInstance = threader.QueueSystem(max_threads= self.MAX_THREADS)
-        self.refresh_hashmaps()
+        self.garbageCollector = garbage.GarbageCollector(backend=self)
         self.missing = {}
         self.progress_dict = {}
+        # Playlists with a sync running, the garbage collector leaves their tracks alone meanwhile
+        self.syncing = set()
+        # The running codec migration (see migrate_codec), None when there is none
+        self.migration = None
 
     def set_constants(self):
-        self.configInstance = config.Config()
         self.TEMP_PATH = self.configInstance.get("download_settings",{}).get("temp_path","./")
         self.CACHE_PATH = self.configInstance.get("download_settings",{}).get("cache_path","./")
         self.ENCODE_QUALITY = self.configInstance.get("download_settings",{}).get("encode_quality",8)
@@ -31,10 +50,60 @@ class Backend():
         self.FILENAME_TEMPLATE = self.configInstance.get("download_settings",{}).get("filename_template","")
         self.COVER_MODE = self.configInstance.get("download_settings",{}).get("cover_mode","crop")
         self.CODEC = self.configInstance.get("download_settings",{}).get("encode_codec","mp3")
+        self.ANALYZE_LOUDNESS = self.configInstance.get("download_settings",{}).get("analyze_loudness",False)
+        self.STREAM_DOWNLOADS = self.configInstance.get("download_settings",{}).get("stream_downloads",True)
         self.MAX_THREADS = self.configInstance.get("download_settings",{}).get("max_threads",2)
+        self.MAX_BYTES_PER_SECOND = self.configInstance.get("download_settings",{}).get("max_bytes_per_second",0)
+        self.MAX_REQUESTS_PER_SECOND = self.configInstance.get("download_settings",{}).get("max_requests_per_second",0)
+        self.COVER_SIZES = self.configInstance.get("download_settings",{}).get("cover_sizes",[64,128,640])
+        self.COVER_FORMAT = self.configInstance.get("download_settings",{}).get("cover_format","jpeg")
+        self.COVER_QUALITY = self.configInstance.get("download_settings",{}).get("cover_quality",85)
+        self.EMBED_COVER_SIZE = self.configInstance.get("download_settings",{}).get("embed_cover_size",640)
+        self.EMBED_COVER_QUALITY = self.configInstance.get("download_settings",{}).get("embed_cover_quality",90)
+        self.DOWNLOAD_RETRIES = self.configInstance.get("download_settings",{}).get("download_retries",3)
+        self.UNAVAILABLE_TTL_HOURS = self.configInstance.get("download_settings",{}).get("unavailable_ttl_hours",168)
+        self.LIBRARY_FLUSH_MS = self.configInstance.get("download_settings",{}).get("library_flush_ms",500)
+        self.LIBRARY_FLUSH_MUTATIONS = self.configInstance.get("download_settings",{}).get("library_flush_mutations",200)
+        self.CACHE_BUDGET_MB = self.configInstance.get("download_settings",{}).get("cache_budget_mb",512)
+        self.GC_INTERVAL_MINUTES = self.configInstance.get("download_settings",{}).get("gc_interval_minutes",30)
+        self.GC_TEMP_MAX_AGE_HOURS = self.configInstance.get("download_settings",{}).get("gc_temp_max_age_hours",6)
+        self.GC_REMOVE_DELETED_TRACKS = self.configInstance.get("download_settings",{}).get("gc_remove_deleted_tracks",False)
+        self.GC_REMOVED_GRACE_HOURS = self.configInstance.get("download_settings",{}).get("gc_removed_grace_hours",24)
+        self.GENERATE_WAVEFORMS = self.configInstance.get("download_settings",{}).get("generate_waveforms",True)
+        self.PREVIEW_LENGTH = self.configInstance.get("download_settings",{}).get("preview_length",15)
+        self.PREVIEW_MEMORY_CACHE_MB = self.configInstance.get("download_settings",{}).get("preview_memory_cache_mb",32)
+        self.PREVIEW_DISK_CACHE_MB = self.configInstance.get("download_settings",{}).get("preview_disk_cache_mb",256)
         os.makedirs(self.DOWNLOAD_FOLDER, exist_ok=True)
         os.makedirs(self.CACHE_PATH, exist_ok=True)
         os.makedirs(self.TEMP_PATH, exist_ok=True)
+        self.coverCache = covers.CoverCache(cache_path=self.CACHE_PATH, sizes=self.COVER_SIZES, image_format=self.COVER_FORMAT,
+                                            quality=self.COVER_QUALITY, embed_size=self.EMBED_COVER_SIZE, embed_quality=self.EMBED_COVER_QUALITY)
+        self.waveformStore = waveforms.WaveformStore(cache_path=self.CACHE_PATH)
+
+    def create_library(self):
+        return library.Library(filepath=self.DOWNLOAD_FOLDER, flush_interval=self.LIBRARY_FLUSH_MS / 1000, flush_mutations=self.LIBRARY_FLUSH_MUTATIONS)
+
+    def create_preview_service(self):
+        return previews.PreviewService(backend=self, clip_length=self.PREVIEW_LENGTH, memory_budget=self.PREVIEW_MEMORY_CACHE_MB * 2 ** 20,
+                                       disk_budget=self.PREVIEW_DISK_CACHE_MB * 2 ** 20)
+
+    def job_settings(self):
+        """Snapshot of the settings a download job runs with, so later config changes don't affect queued jobs."""
+        return {
+            "temp_path": self.TEMP_PATH,
+            "cache_path": self.CACHE_PATH,
+            "encode_quality": self.ENCODE_QUALITY,
+            "filename_template": self.FILENAME_TEMPLATE,
+            "cover_mode": self.COVER_MODE,
+            "encode_codec": self.CODEC,
+            "analyze_loudness": self.ANALYZE_LOUDNESS,
+            "stream_downloads": self.STREAM_DOWNLOADS,
+            "cover_cache": self.coverCache,
+            "download_retries": self.DOWNLOAD_RETRIES,
+            "unavailable_ttl_hours": self.UNAVAILABLE_TTL_HOURS,
+            "generate_waveforms": self.GENERATE_WAVEFORMS,
+            "waveform_store": self.waveformStore,
+        }
 
     def refresh_hashmaps(self):
         cached_filename_list = [os.path.join(self.CACHE_PATH, f) for f in os.listdir(self.CACHE_PATH) if
@@ -44,30 +113,48 @@ class Backend():
                                 not os.path.isfile(os.path.join(self.DOWNLOAD_FOLDER, f))]
         self.song_hash_map = {}
         for i in playlist_folder_list:
-            if os.path.exists(os.path.join(i, ".id_file")):
-                with open(os.path.join(i, ".id_file"), "r") as f:
+            if os.path.exists(os.path.join(i, ".id")):
+                with open(os.path.join(i, ".id"), "r") as f:
                     data = json.load(f)
-                song_filename_list = [os.path.join(self.DOWNLOAD_FOLDER, i, f) for f in
-                                      os.listdir(os.path.join(self.DOWNLOAD_FOLDER, i)) if
-                                      os.path.isfile(os.path.join(self.DOWNLOAD_FOLDER, i, f))]
+                song_filename_list = [os.path.join(i, f) for f in os.listdir(i) if
+                                      os.path.isfile(os.path.join(i, f)) and f != ".id"]
                 self.song_hash_map[data.get("id")] = {helper_functions.hash_file(fn): fn for fn in song_filename_list}
 
     def check_avail(self):
+        """Record downloaded tracks whose file is gone in self.missing and derive covers missing from the cover cache
+        again, from the audio file when it is there, otherwise from the cover url."""
+        online = True
         for i in self.libraryInstance.get_playlists():
+            folder = self.find_playlist_folder(i)
+            found, _ = self.locate_track_files(i, folder) if folder is not None else ({}, [])
             for j in self.libraryInstance.get_playlist_items_data(playlist_id=i):
-                if j.get("success"):
-                    song = True
-                    if not j.get("file_info",{}).get("media_hash") in self.song_hash_map.get(j.get("playlist_id")):
-                        song = False
-                        self.missing[j.get("track_id")][j.get("playlist_id")] = True
-                    if not j.get("file_info",{}).get("cover_hash") in self.cached_hash_map:
-                        file_name = str(uuid.uuid4())
-                        if song is False:
-                            cover_path, cover_hash = helper_functions.download_file(url=j.get("file_info",{}).get("cover_url"),save_path=f"{self.CACHE_PATH}/{file_name}.png")
-                            helper_functions.adjust_image_to_square(img_path=cover_path, mode=self.COVER_MODE)
-                        else:
-                            helper_functions.extract_cover_from_audio(input_file=self.song_hash_map[j.get("playlist_id")][j.get("track_id")],output_file=f"{self.CACHE_PATH}/{file_name}.png")
-                        self.libraryInstance.set_track_data(playlist_id=i,track_id=j.get("playlist_id"),data={"file_info":{"cover_hash":helper_functions.hash_file(f"{self.CACHE_PATH}/{file_name}.png")}})
+                if not j.get("success"):
+                    continue
+                if j.get("track_id") not in found:
+                    self.missing.setdefault(j.get("track_id"), {})[i] = True
+                file_info = j.get("file_info", {})
+                cover_hash = file_info.get("cover_hash")
+                if cover_hash is not None and self.coverCache.has(cover_hash, mode=self.COVER_MODE):
+                    continue
+                cover_path = os.path.join(self.TEMP_PATH, f"{uuid.uuid4()}.jpg")
+                try:
+                    if j.get("track_id") in found:
+                        helper_functions.extract_cover_from_audio(input_file=os.path.join(folder, found[j.get("track_id")]), output_file=cover_path)
+                    if not os.path.exists(cover_path) and file_info.get("cover_url") and online:
+                        if helper_functions.download_file(url=file_info.get("cover_url"), save_path=cover_path, governor=self.governor)[0] is None:
+                            print("Offline, missing covers are downloaded on the next run.")
+                            online = False
+                    if not os.path.exists(cover_path):
+                        continue
+                    # The id is kept so covers evicted from the cache come back under the id the library refers to
+                    cover_hash = self.coverCache.add(source_path=cover_path, cover_id=cover_hash, mode=self.COVER_MODE)
+                finally:
+                    if os.path.exists(cover_path):
+                        os.remove(cover_path)
+                file_info = dict(file_info)
+                file_info["cover_hash"] = cover_hash
+                file_info["cover_mode"] = self.COVER_MODE
+                self.libraryInstance.set_track_data(playlist_id=i, track_id=j.get("track_id"), data={"file_info": file_info})
 
     def youtube_progress_callback(self,info,playlist_id,track_id):
         if info["status"] == "downloading":
@@ -86,7 +173,22 @@ class Backend():
         elif info["status"] == "finished":
             print("Download finished, now processing...")
 
-    def download_track(self,library_uri:str,playlist_id:str,output_folder:str):
+    def download_track(self,library_uri:str,playlist_id:str,output_folder:str,settings:dict=None):
+        """Download a track, retrying transient failures with backoff. Tracks that are permanently unavailable
+        (private, removed, blocked, ...) are remembered so syncs skip them until unavailable_ttl_hours passed."""
+        if settings is None:
+            settings = self.job_settings()
+        try:
+            failures.with_retries(lambda: self._download_track_once(library_uri, playlist_id, output_folder, settings), attempts=settings["download_retries"])
+        except Exception as e:
+            kind, reason = failures.classify(e)
+            if kind == failures.PERMANENT:
+                self.libraryInstance.set_track_unavailable(playlist_id=playlist_id, track_id=library_uri, reason=reason,
+                                                           until=time.time() + settings["unavailable_ttl_hours"] * 3600)
+            raise e
+        self.libraryInstance.set_track_unavailable(playlist_id=playlist_id, track_id=library_uri, reason=None)
+
+    def _download_track_once(self,library_uri:str,playlist_id:str,output_folder:str,settings:dict):
         random_uuid = str(uuid.uuid4())
         service = library_uri.split(":")[0]
         item_type = library_uri.split(":")[1]
@@ -95,16 +197,41 @@ class Backend():
         try:
             if item_type == "track":
                 if service == "youtube":
-                    result_data = self.youtubeInstance.download_track(youtube_id=id,download_folder=self.TEMP_PATH)
+                    result_data = self.youtubeInstance.get_stream(youtube_id=id) if settings["stream_downloads"] else None
                     #self.progress_dict[playlist_id][id] = {"status_msg": "Downloading cover", "progress_val": 50}
-                    cover_path, cover_hash = helper_functions.download_file(url = result_data["cover_url"],save_path=f"{self.CACHE_PATH}/{random_uuid}.png")
+                    if result_data is None or not result_data["stream"]["streamable"]:
+                        # Formats ffmpeg can't read from a pipe go through a temp file that is removed after transcoding
+                        result_data = self.youtubeInstance.download_track(youtube_id=id,download_folder=settings["temp_path"])
+                    cover_path, cover_hash = helper_functions.download_file(url = result_data["cover_url"],save_path=f"{settings['temp_path']}/{random_uuid}.jpg",governor=self.governor)
                     #self.progress_dict[playlist_id][id] = {"status_msg": "Finished", "progress_val": 100}
-                    helper_functions.adjust_image_to_square(img_path=cover_path,mode=self.COVER_MODE)
-                    #self.progress_dict[playlist_id][id] = {"status_msg": "Transcoding media", "progress_val": 0}
-                    filename = helper_functions.sanitize(helper_functions.template_decoder(template=self.FILENAME_TEMPLATE,data=result_data))
-                    output_file,media_bitrate = helper_functions.transcode_audio(input_file=result_data["file_path"],output_path=output_folder,filename=filename,overwrite=True,out_codec=self.CODEC,quality=self.ENCODE_QUALITY)
-                    helper_functions.edit_audio_metadata(input_file=output_file,data=result_data)
-                    helper_functions.replace_image_in_track(input_file=output_file,input_cover=cover_path)
+                    try:
+                        settings["cover_cache"].add(source_path=cover_path, cover_id=cover_hash, mode=settings["cover_mode"])
+                        #self.progress_dict[playlist_id][id] = {"status_msg": "Transcoding media", "progress_val": 0}
+                        filename = helper_functions.sanitize(helper_functions.template_decoder(template=settings["filename_template"],data=result_data))
+                        try:
+                            if "file_path" in result_data:
+                                input_file, input_chunks = result_data["file_path"], None
+                            else:
+                                input_file, input_chunks = None, helper_functions.iter_url_chunks(url=result_data["stream"]["url"],headers=result_data["stream"]["headers"],governor=self.governor)
+                            peaks = waveforms.PeakAccumulator() if settings["generate_waveforms"] else None
+                            output_file,media_bitrate,loudness = helper_functions.transcode_audio(input_file=input_file,input_chunks=input_chunks,output_path=output_folder,filename=filename,overwrite=True,out_codec=settings["encode_codec"],quality=settings["encode_quality"],analyze_loudness=settings["analyze_loudness"],pcm_sink=peaks.feed if peaks else None)
+                        finally:
+                            if "file_path" in result_data and os.path.exists(result_data["file_path"]):
+                                os.remove(result_data["file_path"])
+                        helper_functions.edit_audio_metadata(input_file=output_file,data=result_data)
+                        embed_path = settings["cover_cache"].embed_path(cover_hash)
+                        if embed_path is None:
+                            # Evicted while transcoding, the source image is still there
+                            settings["cover_cache"].add(source_path=cover_path, cover_id=cover_hash, mode=settings["cover_mode"])
+                            embed_path = settings["cover_cache"].embed_path(cover_hash)
+                        helper_functions.replace_image_in_track(input_file=output_file,input_cover=embed_path)
+                    finally:
+                        if os.path.exists(cover_path):
+                            os.remove(cover_path)
+                    if loudness:
+                        helper_functions.write_replaygain_tags(input_file=output_file,loudness=loudness)
+                    if peaks is not None:
+                        settings["waveform_store"].write(track_id=library_uri, peaks=peaks.finish(), peaks_per_second=peaks.peaks_per_second)
                     #self.progress_dict[playlist_id][id] = {"status_msg": "Finished", "progress_val": 100}
                     print("Download complete!")
                     self.libraryInstance.set_track_data(playlist_id=playlist_id,track_id=library_uri,data=
@@ -112,12 +239,14 @@ class Backend():
                      "release":result_data["release"],
                      "file_info":{
                         "cover_url":result_data.get("cover_url"),
-                        "cover_mode":self.COVER_MODE,
-                        "cover_hash": helper_functions.hash_file(cover_path),
-                        "media_container": self.CODEC,
+                        "cover_mode":settings["cover_mode"],
+                        "cover_hash": cover_hash,
+                        "media_container": settings["encode_codec"],
                         "media_bitrate": media_bitrate,
                         "media_hash": helper_functions.hash_file(output_file),
+                        "media_file": os.path.basename(output_file),
                         "length":result_data.get("length",0),
+                        **(loudness or {}),
             }})
         except Exception as e:
             print(e)
@@ -134,6 +263,13 @@ class Backend():
             else:
                 raise ConnectionError("No internet connection.")
     def sync_playlist(self,library_uri:str):
+        self.syncing.add(library_uri)
+        try:
+            return self._sync_playlist(library_uri)
+        finally:
+            self.syncing.discard(library_uri)
+
+    def _sync_playlist(self,library_uri:str):
         service = library_uri.split(":")[0]
         item_type = library_uri.split(":")[1]
         id = library_uri.split(":")[-1]
@@ -144,41 +280,315 @@ class Backend():
         if not self.libraryInstance.verify_library_path(library_uri):
             raise ValueError("Playlist does not exist.")
         if service == "youtube":
-            yt_music_data = self.youtubeInstance.get_playlist(youtube_id=id)
-            new_item_list = {f"youtube:track:{item['youtube_id']}": item for item in yt_music_data["tracks"]}
-            new_item_id_list = [f"youtube:track:{item['youtube_id']}" for item in yt_music_data["tracks"]]
-            existing_item_id_list = self.libraryInstance.get_playlist_items_ids(playlist_id=library_uri)
-            positive, negative = helper_functions.get_difference(existing_item_id_list, new_item_id_list)
-            for item_id in positive:
-                song_data = {
-                    "success": False,
-                    "title": new_item_list[item_id]["title"],
-                    "artist": [i for i in new_item_list[item_id]["artists"]],
-                    "album": new_item_list[item_id].get("album", "Unknown album"),
-                    "release": None,
-                    "track_id": item_id,
-                    "playlist_id": library_uri,
-                }
-                self.libraryInstance.add_track(playlist_id=library_uri,track_id=item_id, data=song_data)
-            job_list = []
             output_folder = os.path.join(self.DOWNLOAD_FOLDER, helper_functions.sanitize(self.libraryInstance.get_playlist_full(library_uri).get('folder_name')))
             os.makedirs(output_folder, exist_ok=True)
             if not os.path.exists(os.path.join(output_folder,".id")):
                 with open(os.path.join(output_folder,".id"), "w") as f:
                     json.dump({"id": library_uri}, f)
 
-            for item in self.libraryInstance.get_playlist_items_data(library_uri):
-                if item.get("success", False) == False:
-                    job_list.append(
-                        lambda passed_item=item: self.download_track(library_uri=passed_item["track_id"], playlist_id=library_uri,output_folder=output_folder)
-                    )
+            settings = self.job_settings()
+            existing_items = {item["track_id"]: item for item in self.libraryInstance.get_playlist_items_data(library_uri)}
+            seen, queued, added, reappeared = set(), set(), [], []
+            now = time.time()
+
+            def wanted(item_id):
+                # Downloaded tracks and tracks known to be unavailable (until their entry expires) aren't queued
+                item = existing_items.get(item_id)
+                return item is None or (not item.get("success", False) and item.get("unavailable_until", 0) <= now)
+
+            def queue(track_ids):
+                job_list = [
+                    lambda passed_id=track_id: self.download_track(library_uri=passed_id, playlist_id=library_uri,output_folder=output_folder,settings=settings)
+                    for track_id in track_ids if track_id not in queued
+                ]
+                queued.update(track_ids)
+                self.threadingInstance.submit_jobs(job_list)
+
+            # Every page is diffed and queued as soon as it arrives, downloads start while the listing continues
+            for page in self.youtubeInstance.iter_playlist(playlist_id=id):
+                new_items, metadata_updates, page_ids = {}, {}, []
+                for upstream in page:
+                    item_id = f"youtube:track:{upstream['youtube_id']}"
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    page_ids.append(item_id)
+                    upstream_data = {"title": upstream["title"], "artist": list(upstream["artists"]), "album": upstream.get("album", "Unknown album")}
+                    if "removed_upstream" in existing_items.get(item_id, {}):
+                        reappeared.append(item_id)
+                    if item_id not in existing_items:
+                        new_items[item_id] = {
+                            "success": False,
+                            **upstream_data,
+                            "release": None,
+                            "track_id": item_id,
+                            "playlist_id": library_uri,
+                            "upstream_metadata": upstream_data,
+                        }
+                    else:
+                        last_seen = existing_items[item_id].get("upstream_metadata")
+                        if last_seen != upstream_data:
+                            # Only values edited upstream since the last sync are taken over, edits made in the library
+                            # stay (retag_library brings the files in line afterwards). Without a last seen state
+                            # (tracks synced before it was stored) the library values are kept.
+                            changed = {key: value for key, value in upstream_data.items() if last_seen is not None and last_seen.get(key) != value}
+                            metadata_updates[item_id] = {**changed, "upstream_metadata": upstream_data}
+                if new_items:
+                    self.libraryInstance.add_tracks(playlist_id=library_uri, items=new_items)
+                    added.extend(new_items)
+                if metadata_updates:
+                    self.libraryInstance.set_tracks_data(playlist_id=library_uri, updates=metadata_updates)
+                queue([i for i in page_ids if i in new_items or wanted(i)])
 
-            self.threadingInstance.submit_jobs(job_list)
+            negative = [i for i in existing_items if i not in seen]
+            queue([i for i in negative if wanted(i)])
+            # The garbage collector removes files of tracks that stay gone (if gc_remove_deleted_tracks is on)
+            self.libraryInstance.set_removed_upstream(playlist_id=library_uri, track_ids=negative, when=now)
+            self.libraryInstance.set_removed_upstream(playlist_id=library_uri, track_ids=reappeared, when=None)
             self.threadingInstance.wait_completion()
-    def reload_config(self):
+            self.libraryInstance.flush()
+            failed, unavailable = [], {}
+            for item in self.libraryInstance.get_playlist_items_data(library_uri):
+                if item.get("success", False):
+                    continue
+                if item.get("unavailable_until", 0) > time.time():
+                    unavailable[item["track_id"]] = item["unavailable_reason"]
+                else:
+                    failed.append(item["track_id"])
+            return {"added": len(added), "removed": len(negative), "queued": len(queued), "failed": failed, "unavailable": unavailable}
+
+    def find_playlist_folder(self, library_uri: str):
+        """Folder on disk holding a playlist, found through the .id marker (folder_name may have changed since)."""
+        folder = os.path.join(self.DOWNLOAD_FOLDER, helper_functions.sanitize(self.libraryInstance.get_playlist_full(library_uri).get("folder_name")))
+        candidates = [folder] + [os.path.join(self.DOWNLOAD_FOLDER, f) for f in os.listdir(self.DOWNLOAD_FOLDER)]
+        for candidate in candidates:
+            if os.path.exists(os.path.join(candidate, ".id")):
+                with open(os.path.join(candidate, ".id"), "r") as f:
+                    if json.load(f).get("id") == library_uri:
+                        return candidate
+        return None
+
+    def locate_track_files(self, library_uri: str, folder: str):
+        """File names of the downloaded tracks of a playlist inside its folder, and the track ids whose file is missing."""
+        folder_files = {f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))}
+        hash_map = None
+        found, missing = {}, []
+        for item in self.libraryInstance.get_playlist_items_data(library_uri):
+            if not item.get("success"):
+                continue
+            file_info = item.get("file_info", {})
+            name = file_info.get("media_file")
+            if name is None or name not in folder_files:
+                # Tracks downloaded before media_file was recorded are found by their hash once
+                if hash_map is None:
+                    hash_map = {helper_functions.hash_file(os.path.join(folder, f)): f for f in folder_files}
+                name = hash_map.get(file_info.get("media_hash"))
+            if name is None:
+                missing.append(item["track_id"])
+            else:
+                found[item["track_id"]] = name
+        return found, missing
+
+    def relayout_playlist(self, library_uri: str, dry_run: bool = False):
+        """Rename the files (and folder) of a playlist to the current filename_template and folder_name.
+        Only renames, audio is never read or re-encoded."""
+        if not self.libraryInstance.verify_library_path(library_uri):
+            raise ValueError("Playlist does not exist.")
+        relayout.rollback(self.DOWNLOAD_FOLDER)
+        current_folder = self.find_playlist_folder(library_uri)
+        if current_folder is None:
+            return {"folder": None, "renamed": {}, "missing": []}
+        target_folder = os.path.join(self.DOWNLOAD_FOLDER, helper_functions.sanitize(self.libraryInstance.get_playlist_full(library_uri).get("folder_name")))
+
+        compiled_template = helper_functions.compile_template(self.FILENAME_TEMPLATE)
+        current, missing = self.locate_track_files(library_uri, current_folder)
+        folder_files = [f for f in os.listdir(current_folder) if os.path.isfile(os.path.join(current_folder, f))]
+        wanted = {}
+        for track_id, name in current.items():
+            template_data = relayout.track_template_data(self.libraryInstance.get_track_full(library_uri, track_id))
+            new_name = helper_functions.sanitize(helper_functions.render_template(compiled_template, template_data)) or template_data["id"]
+            wanted[track_id] = new_name + os.path.splitext(name)[1]
+
+        # Tracks that already have their name keep it, everything else is numbered around them
+        ordered = dict(sorted(wanted.items(), key=lambda i: current[i[0]] != i[1]))
+        occupied = {f.lower() for f in folder_files if f not in current.values()}
+        final = relayout.resolve_collisions(ordered, occupied)
+        renamed = {track_id: [current[track_id], final[track_id]] for track_id in current if current[track_id] != final[track_id]}
+
+        folder_rel = os.path.relpath(current_folder, self.DOWNLOAD_FOLDER)
+        target_rel = os.path.relpath(target_folder, self.DOWNLOAD_FOLDER)
+        steps = []
+        if os.path.abspath(current_folder) != os.path.abspath(target_folder):
+            if os.path.exists(target_folder):
+                raise FileExistsError(f"Folder {target_folder} already exists!")
+            steps.append([folder_rel, target_rel])
+        # Two passes through temporary names, so swapped or chained names never overwrite each other
+        for index, (old_name, new_name) in enumerate(renamed.values()):
+            steps.append([os.path.join(target_rel, old_name), os.path.join(target_rel, f".relayout-{index}.tmp")])
+        for index, (old_name, new_name) in enumerate(renamed.values()):
+            steps.append([os.path.join(target_rel, f".relayout-{index}.tmp"), os.path.join(target_rel, new_name)])
+
+        if not dry_run:
+            relayout.apply(self.DOWNLOAD_FOLDER, steps)
+            updates = {}
+            for track_id, name in final.items():
+                file_info = dict(self.libraryInstance.get_track_full(library_uri, track_id).get("file_info", {}))
+                if file_info.get("media_file") != name:
+                    file_info["media_file"] = name
+                    updates[track_id] = {"file_info": file_info}
+            self.libraryInstance.set_tracks_data(playlist_id=library_uri, updates=updates)
+        return {"folder": target_folder, "renamed": renamed, "missing": missing}
+
+    def migrate_codec(self, playlist_ids: list = None, processes: int = None):
+        """Re-encode downloaded tracks to the configured encode_codec/encode_quality. While it runs,
+        self.migration can be paused, throttled or stopped from another thread."""
+        self.migration = migration.CodecMigration(backend=self, encode_codec=self.CODEC, encode_quality=self.ENCODE_QUALITY, processes=processes)
+        try:
+            return self.migration.run(playlist_ids)
+        finally:
+            self.migration = None
+
+    def retag_library(self, playlist_ids: list = None, covers: bool = True, workers: int = None, force: bool = False):
+        """Bring the tags of downloaded files in line with the library, rewriting only files and frames that differ.
+        Files whose library metadata and mtime/size didn't change since the last retag aren't even opened."""
+        result = {"checked": 0, "skipped": 0, "retagged": {}, "failed": {}}
+        for playlist_id in playlist_ids or self.libraryInstance.get_playlists():
+            folder = self.find_playlist_folder(playlist_id)
+            if folder is None:
+                continue
+            files, _ = self.locate_track_files(playlist_id, folder)
+            jobs = []
+            for track_id, media_file in files.items():
+                if os.path.splitext(media_file)[1].lstrip(".").lower() not in retag.SUPPORTED_CONTAINERS:
+                    continue
+                item = self.libraryInstance.get_track_full(playlist_id, track_id)
+                file_info = item.get("file_info", {})
+                path = os.path.join(folder, media_file)
+                cover_hash = file_info.get("cover_hash") if covers else None
+                tags = retag.desired_tags(item)
+                tag_fingerprint = retag.fingerprint(tags, cover_hash)
+                if not force and file_info.get("tag_fingerprint") == tag_fingerprint and file_info.get("tag_stamp") == retag.file_stamp(path):
+                    result["skipped"] += 1
+                    continue
+                jobs.append((track_id, path, tags, self.coverCache.embed_path(cover_hash), tag_fingerprint, file_info))
+
+            def run(job):
+                track_id, path, tags, cover_file, tag_fingerprint, file_info = job
+                changed = retag.retag_file(path=path, tags=tags, cover_file=cover_file)
+                file_info = dict(file_info)
+                if changed:
+                    file_info["media_hash"] = helper_functions.hash_file(path)
+                file_info["tag_fingerprint"] = tag_fingerprint
+                file_info["tag_stamp"] = retag.file_stamp(path)
+                return changed, file_info
+
+            updates = {}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers or self.MAX_THREADS) as executor:
+                futures = {executor.submit(run, job): job[0] for job in jobs}
+                for future in concurrent.futures.as_completed(futures):
+                    track_id = futures[future]
+                    result["checked"] += 1
+                    try:
+                        changed, file_info = future.result()
+                    except Exception as e:
+                        result["failed"][track_id] = str(e)
+                        continue
+                    if changed:
+                        result["retagged"][track_id] = changed
+                    updates[track_id] = {"file_info": file_info}
+            if updates:
+                self.libraryInstance.set_tracks_data(playlist_id=playlist_id, updates=updates)
+        return result
+
+    def backfill_waveforms(self, playlist_ids: list = None, workers: int = None, force: bool = False):
+        """Generate the peak files of downloaded tracks that don't have one yet (downloaded before waveforms existed)."""
+        result = {"generated": 0, "skipped": 0, "failed": {}}
+        jobs = {}
+        for playlist_id in playlist_ids or self.libraryInstance.get_playlists():
+            folder = self.find_playlist_folder(playlist_id)
+            if folder is None:
+                continue
+            files, _ = self.locate_track_files(playlist_id, folder)
+            for track_id, media_file in files.items():
+                # A track in several playlists only needs one waveform
+                if track_id in jobs or (not force and self.waveformStore.has(track_id)):
+                    result["skipped"] += 1
+                    continue
+                jobs[track_id] = os.path.join(folder, media_file)
+
+        def run(track_id):
+            self.waveformStore.write(track_id=track_id, peaks=waveforms.analyze_file(jobs[track_id]))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or self.MAX_THREADS) as executor:
+            futures = {executor.submit(run, track_id): track_id for track_id in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                    result["generated"] += 1
+                except Exception as e:
+                    result["failed"][futures[future]] = str(e)
+        return result
+
+    def verify_library(self, repair: bool = False):
+        """Check that every downloaded track still has its file on disk. With repair, missing tracks get re-queued on the next sync."""
+        result = {}
+        for playlist_id in self.libraryInstance.get_playlists():
+            checked = sum(1 for item in self.libraryInstance.get_playlist_items_data(playlist_id) if item.get("success"))
+            folder = self.find_playlist_folder(playlist_id)
+            if folder is None:
+                missing = [item["track_id"] for item in self.libraryInstance.get_playlist_items_data(playlist_id) if item.get("success")]
+            else:
+                # Looks files up by their recorded name, only hashing the folder for tracks without one
+                _, missing = self.locate_track_files(playlist_id, folder)
+            if repair:
+                for track_id in missing:
+                    self.libraryInstance.set_track_data(playlist_id=playlist_id, track_id=track_id, data={"success": False})
+            result[playlist_id] = {"checked": checked, "missing": missing}
+        return result
+
+    def get_stats(self):
+        stats = {"playlists": {}, "tracks": 0, "downloaded": 0, "pending": 0, "unavailable": 0, "unavailable_reasons": {}}
+        now = time.time()
+        for playlist_id in self.libraryInstance.get_playlists():
+            items = self.libraryInstance.get_playlist_items_data(playlist_id)
+            downloaded = sum(1 for i in items if i.get("success"))
+            reasons = [i["unavailable_reason"] for i in items if not i.get("success") and i.get("unavailable_until", 0) > now]
+            stats["playlists"][playlist_id] = {
+                "title": self.libraryInstance.get_playlist_full(playlist_id).get("title"),
+                "tracks": len(items),
+                "downloaded": downloaded,
+                "pending": len(items) - downloaded - len(reasons),
+                "unavailable": len(reasons),
+            }
+            stats["tracks"] += len(items)
+            stats["downloaded"] += downloaded
+            stats["pending"] += len(items) - downloaded - len(reasons)
+            stats["unavailable"] += len(reasons)
+            for reason in reasons:
+                stats["unavailable_reasons"][reason] = stats["unavailable_reasons"].get(reason, 0) + 1
+        stats["governor"] = self.governor.utilisation()
+        return stats
+    def reload_config(self, max_threads: int = None):
+        """Apply config changes in place. Running jobs keep the settings they were queued with.
+        max_threads overrides max_threads from the config (e.g. a --jobs given on the command line)."""
+        old_download_folder = self.DOWNLOAD_FOLDER
+        old_cache_path = self.CACHE_PATH
+        old_preview_settings = (self.CACHE_PATH, self.PREVIEW_LENGTH, self.PREVIEW_MEMORY_CACHE_MB, self.PREVIEW_DISK_CACHE_MB)
+        self.configInstance.reload()
         self.set_constants()
-        self.libraryInstance = library.Library(filepath=self.DOWNLOAD_FOLDER)
-        self.threadingInstance = threader.QueueSystem(max_threads=self.MAX_THREADS)
+        if os.path.abspath(self.CACHE_PATH) != os.path.abspath(old_cache_path):
+            self.trackResolver = provider.TrackResolver(target=self.youtubeInstance, cache_file=os.path.join(self.CACHE_PATH, "match_cache.json"))
+        preview_settings = (self.CACHE_PATH, self.PREVIEW_LENGTH, self.PREVIEW_MEMORY_CACHE_MB, self.PREVIEW_DISK_CACHE_MB)
+        if preview_settings != old_preview_settings:
+            self.previewService.shutdown()
+            self.previewService = self.create_preview_service()
+        if os.path.abspath(self.DOWNLOAD_FOLDER) != os.path.abspath(old_download_folder):
+            # Same instance, the GUI and the garbage collector hold on to it
+            self.libraryInstance.reopen(filepath=self.DOWNLOAD_FOLDER)
+        self.libraryInstance.flush_interval = self.LIBRARY_FLUSH_MS / 1000
+        self.libraryInstance.flush_mutations = self.LIBRARY_FLUSH_MUTATIONS
+        self.threadingInstance.resize(max_threads or self.MAX_THREADS)
+        self.governor.configure(bytes_per_second=self.MAX_BYTES_PER_SECOND, requests_per_second=self.MAX_REQUESTS_PER_SECOND)
 
 if __name__ == "__main__":
     print("This isn't the place to launch the gui!")
@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import time
+import backend.helper_functions as helper_functions
+
+STEP_BATCH = 25  # units of work (files, playlists) between pauses
+STEP_PAUSE = 0.2  # seconds, keeps the collector from competing with downloads for the disk
+LEGACY_COVER_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+COVER_LEASE = 900  # seconds, covers used more recently may belong to a download that hasn't stored its cover_hash yet
+# Names of the files the backend creates in temp_path: <uuid4>.jpg covers and yt-dlp's <youtube id>.<ext>[.part] downloads
+TEMP_FILE = re.compile(r"^(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.jpg"
+                       r"|[A-Za-z0-9_-]{11}(?:\.(?:f\d+|temp|webm|weba|m4a|mp4|mp3|ogg|opus|aac|part|ytdl))+)$")
+
+
+class GarbageCollector:
+    """Frees disk space the rest of the backend never gives back.
+
+    - covers in the cover cache no track references anymore, least recently used first, until the cache fits
+      cache_budget_mb, sparing covers used in the last COVER_LEASE seconds. Referenced covers are never evicted,
+      so the budget is exceeded when they alone are larger
+    - old uuid named covers in the root of cache_path that no track references anymore
+    - waveform files of tracks that are no longer in the library
+    - temp files of the backend (see TEMP_FILE) older than gc_temp_max_age_hours (leftovers of crashed or killed downloads)
+    - optionally files and entries of tracks that were removed from their upstream playlist
+      more than gc_removed_grace_hours ago
+
+    A pass is a generator yielding after every unit of work, so it can run in small slices on a background
+    thread (start()/stop()) or in one go (collect()). Settings are read from the backend at the start of every
+    pass, so reload_config applies to the next one.
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            raise ValueError("No backend was given!")
+        self.backend = backend
+        self.stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.last_result = None
+
+    @staticmethod
+    def _remove(path: str, result: dict) -> bool:
+        """Delete a file and count its size, False if it is already gone."""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        result["bytes_freed"] += size
+        return True
+
+    def _pass(self, result: dict):
+        backend = self.backend
+        library = backend.libraryInstance
+        now = time.time()
+
+        # References
+        cover_refs, track_ids = {}, set()
+        for playlist_id in library.get_playlists():
+            loaded = library.is_loaded(playlist_id)
+            for item in library.get_playlist_items_data(playlist_id):
+                track_ids.add(item["track_id"])
+                cover_hash = item.get("file_info", {}).get("cover_hash")
+                if cover_hash:
+                    cover_refs[cover_hash] = cover_refs.get(cover_hash, 0) + 1
+            if not loaded:
+                # Shards only loaded for the pass don't stay in memory
+                library.unload_playlist(playlist_id)
+            yield
+
+        # Temp files
+        max_age = backend.GC_TEMP_MAX_AGE_HOURS * 3600
+        for name in os.listdir(backend.TEMP_PATH):
+            if not TEMP_FILE.match(name):
+                continue  # temp_path may be a folder shared with other files
+            path = os.path.join(backend.TEMP_PATH, name)
+            try:
+                if os.path.isfile(path) and now - os.path.getmtime(path) > max_age and self._remove(path, result):
+                    result["temp_removed"] += 1
+            except OSError:
+                pass  # Removed or still locked by a running download
+            yield
+
+        # Covers of the old flat cache layout
+        for name in os.listdir(backend.CACHE_PATH):
+            path = os.path.join(backend.CACHE_PATH, name)
+            if not os.path.isfile(path) or not name.lower().endswith(LEGACY_COVER_EXTS):
+                continue
+            try:
+                if helper_functions.hash_file(path) not in cover_refs and self._remove(path, result):
+                    result["covers_evicted"] += 1
+            except FileNotFoundError:
+                pass
+            yield
+
+        # Cover cache budget
+        entries = backend.coverCache.entries()
+        total = sum(size for _, size, _ in entries)
+        budget = backend.CACHE_BUDGET_MB * 2 ** 20
+        # Only unreferenced covers, the library would be left pointing at covers that are gone otherwise
+        for cover_id, size, last_use in sorted(entries, key=lambda i: i[2]):
+            if total <= budget:
+                break
+            if cover_id in cover_refs or now - last_use < COVER_LEASE:
+                continue
+            backend.coverCache.remove(cover_id)
+            total -= size
+            result["covers_evicted"] += 1
+            result["bytes_freed"] += size
+            yield
+
+        # Waveforms
+        for path in backend.waveformStore.orphans(track_ids):
+            if self._remove(path, result):
+                result["waveforms_removed"] += 1
+            yield
+
+        # Tracks removed upstream
+        if backend.GC_REMOVE_DELETED_TRACKS:
+            grace = backend.GC_REMOVED_GRACE_HOURS * 3600
+            for playlist_id in library.get_playlists():
+                if playlist_id in backend.syncing:
+                    continue
+                loaded = library.is_loaded(playlist_id)
+                removed = [item for item in library.get_playlist_items_data(playlist_id) if now - item.get("removed_upstream", now) > grace]
+                folder = backend.find_playlist_folder(playlist_id) if removed else None
+                files, _ = backend.locate_track_files(playlist_id, folder) if folder is not None else ({}, [])
+                for item in removed:
+                    if playlist_id in backend.syncing:
+                        break  # a sync started meanwhile and may still update these tracks
+                    track_id = item["track_id"]
+                    if track_id in files:
+                        self._remove(os.path.join(folder, files[track_id]), result)
+                    library.delete_track(playlist_id=playlist_id, track_id=track_id)
+                    result["tracks_removed"] += 1
+                    yield
+                if not loaded:
+                    library.unload_playlist(playlist_id)
+                yield
+
+    def collect(self) -> dict:
+        """Run a whole pass at once."""
+        with self._lock:
+            result = {"temp_removed": 0, "covers_evicted": 0, "waveforms_removed": 0, "tracks_removed": 0, "bytes_freed": 0}
+            for _ in self._pass(result):
+                pass
+            self.last_result = result
+            return result
+
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            with self._lock:
+                result = {"temp_removed": 0, "covers_evicted": 0, "waveforms_removed": 0, "tracks_removed": 0, "bytes_freed": 0}
+                try:
+                    for step, _ in enumerate(self._pass(result), start=1):
+                        if step % STEP_BATCH == 0 and self.stop_event.wait(STEP_PAUSE):
+                            break
+                except Exception as e:
+                    # A failing pass must not take the collector down, the next one retries
+                    print(f"Garbage collection failed: {e}")
+                self.last_result = result
+            self.stop_event.wait(self.backend.GC_INTERVAL_MINUTES * 60)
+
+    def start(self) -> None:
+        """Run a pass every gc_interval_minutes on a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread after its current unit of work."""
+        self.stop_event.set()
@@ -0,0 +1,125 @@
+import collections
+import threading
+import time
+
+WINDOW = 5.0  # seconds the measured rates are averaged over
+
+
+class TokenBucket:
+    """Thread safe token bucket. A rate of 0 (or None) means unlimited.
+
+    acquire() takes the tokens right away and then sleeps off the debt, so amounts larger than the burst size
+    (a big chunk of a download) are possible and waiting callers are served in the order they arrived.
+    """
+
+    def __init__(self, rate: float = 0, burst: float = None):
+        self._lock = threading.Lock()
+        self._history = collections.deque()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float = 0, burst: float = None) -> None:
+        """Change the rate. The tokens (and debt) left are kept, clamped to the new burst, so reconfiguring
+        doesn't hand out a free burst."""
+        rate = float(rate or 0)
+        # One second worth of tokens unless told otherwise
+        burst = float(burst) if burst else max(rate, 1.0)
+        with self._lock:
+            now = time.monotonic()
+            if not hasattr(self, "rate"):
+                self._tokens = burst
+            elif rate == self.rate and burst == self.burst:
+                return
+            elif self.rate > 0:
+                # Settle the refill owed at the old rate before switching
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            else:
+                # Nothing was metered while unlimited
+                self._tokens = burst
+            self.rate = rate
+            self.burst = burst
+            self._tokens = min(self._tokens, burst)
+            self._updated = now
+
+    def _measure(self, now: float, amount: float) -> None:
+        self._history.append((now, amount))
+        while self._history and self._history[0][0] < now - WINDOW:
+            self._history.popleft()
+
+    def acquire(self, amount: float = 1) -> float:
+        """Take `amount` tokens, blocking until the bucket allows it. Returns the time slept."""
+        with self._lock:
+            now = time.monotonic()
+            self._measure(now, amount)
+            if self.rate <= 0:
+                return 0.0
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def measured_rate(self) -> float:
+        """Tokens taken per second over the last WINDOW seconds."""
+        with self._lock:
+            now = time.monotonic()
+            while self._history and self._history[0][0] < now - WINDOW:
+                self._history.popleft()
+            return sum(amount for _, amount in self._history) / WINDOW
+
+
+class Governor:
+    """Download bandwidth (bytes/s) and request rate (requests/s) shared by every worker thread.
+
+    Everything that talks to YouTube takes a request token first, everything that moves media bytes takes
+    byte tokens per chunk. configure() changes the limits while downloads are running.
+    """
+
+    def __init__(self, bytes_per_second: float = 0, requests_per_second: float = 0):
+        self.bandwidth = TokenBucket()
+        self.requests = TokenBucket()
+        self.configure(bytes_per_second, requests_per_second)
+
+    def configure(self, bytes_per_second: float = 0, requests_per_second: float = 0) -> None:
+        self.bandwidth.set_rate(bytes_per_second)
+        self.requests.set_rate(requests_per_second)
+
+    def request(self) -> None:
+        self.requests.acquire(1)
+
+    def consume(self, amount: int = 0) -> None:
+        if amount > 0:
+            self.bandwidth.acquire(amount)
+
+    def throttle(self, chunks):
+        """Pass an iterable of byte chunks through the bandwidth limit."""
+        for chunk in chunks:
+            self.consume(len(chunk))
+            yield chunk
+
+    def progress_hook(self) -> callable:
+        """A yt-dlp progress hook that charges the bytes downloaded since its last call. Sleeping in the hook
+        stalls that download, which keeps yt-dlp under the shared limit."""
+        last = {}
+
+        def hook(info):
+            if info.get("status") != "downloading":
+                return
+            key = info.get("filename") or info.get("tmpfilename")
+            downloaded = info.get("downloaded_bytes") or 0
+            self.consume(downloaded - last.get(key, 0))
+            last[key] = downloaded
+        return hook
+
+    def utilisation(self) -> dict:
+        """Configured limits, measured rates and how much of each limit is in use (None when unlimited)."""
+        result = {}
+        for name, bucket in (("bytes", self.bandwidth), ("requests", self.requests)):
+            measured = bucket.measured_rate()
+            result[name] = {
+                "limit_per_second": bucket.rate,
+                "per_second": round(measured, 2),
+                "utilisation": round(measured / bucket.rate, 3) if bucket.rate > 0 else None,
+            }
+        return result
@@ -1,6 +1,8 @@
 import requests
 import ping3
 import hashlib
+import functools
+import math
 import os
 import re
 import colorsys
@@ -8,12 +10,13 @@ import numpy as np
 from PIL import Image
 import imageio_ffmpeg as ffmpeg
 import subprocess
+import threading
 from mutagen.oggopus import OggOpus
 from mutagen.flac import Picture
 from mutagen.easyid3 import EasyID3
 from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC
-from mutagen.mp4 import MP4, MP4Cover
+from mutagen.id3 import ID3, APIC, TXXX
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
 from mutagen.wave import WAVE
 import eyed3
 import base64
@@ -24,16 +27,48 @@ def check_network():
     return is_online
 
 
-def download_file(url: str, save_path: str):
+def download_file(url: str, save_path: str, governor=None):
     if check_network():
+        if governor is not None:
+            governor.request()
         r = requests.get(url, stream=True)
         r.raise_for_status()
+        chunks = r.iter_content(8192)
         with open(save_path, "wb") as f:
-            for chunk in r.iter_content(8192):
+            for chunk in governor.throttle(chunks) if governor is not None else chunks:
                 f.write(chunk)
         return save_path, hash_file(save_path)
     return None, None
 
+def iter_url_chunks(url: str, headers: dict = None, chunk_size: int = 65536, range_size: int = 10 * 2 ** 20, governor=None):
+    """Yield the body of a url in chunks, fetched in ranged requests (YouTube throttles long single requests).
+    With a governor every ranged request and every chunk counts against its limits."""
+    start = 0
+    with requests.Session() as session:
+        while True:
+            range_headers = dict(headers or {})
+            range_headers["Range"] = f"bytes={start}-{start + range_size - 1}"
+            if governor is not None:
+                governor.request()
+            r = session.get(url, headers=range_headers, stream=True, timeout=30)
+            if r.status_code == 416 and start > 0:
+                return  # the previous range ended exactly at the end of the body
+            r.raise_for_status()
+            received = 0
+            chunks = r.iter_content(chunk_size)
+            for chunk in governor.throttle(chunks) if governor is not None else chunks:
+                received += len(chunk)
+                yield chunk
+            # A server ignoring the range answers 200 with the whole body
+            if r.status_code != 206 or received < range_size:
+                return
+            start += received
+            # "bytes 0-1048575/5242880", the total tells whether another range is left
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and start >= int(total):
+                return
+
+
 def hash_file(filename:str=None):
     if filename:
         if not os.path.exists(filename):
@@ -49,38 +84,37 @@ def hash_file(filename:str=None):
         return md5.hexdigest()
 
 
+UNSAFE_CHARS = re.compile(r'[<>:"/\\|?*\']')
+
+
 def sanitize(s):
-    return re.sub(r'[<>:"/\\|?*\']', '', s)
+    return UNSAFE_CHARS.sub('', s)
 
 
-def template_decoder(template, data: dict = None, magic_char: str = "$"):
+@functools.lru_cache(maxsize=32)
+def compile_template(template, magic_char: str = "$"):
+    """Split a filename template once into (is_keyword, text) parts. An unclosed keyword is dropped."""
+    parts = template.split(magic_char)
+    if len(parts) % 2 == 0:
+        parts = parts[:-1]
+    return tuple((index % 2 == 1, text) for index, text in enumerate(parts) if text or index % 2 == 1)
+
+
+def render_template(compiled_template, data: dict = None):
     if data is None: data = {}
-    final, opened, opened_keyword = "", False, ""
-    for char in template:
-        if not opened:
-            if char == magic_char:
-                opened = True
-            else:
-                final += char
-            continue
-        if opened:
-            if char == magic_char:
-                opened = False
-                final += str(data.get(opened_keyword, ''))
-                opened_keyword = ""
-            else:
-                opened_keyword += char
-            continue
+    final = "".join(str(data.get(text, '')) if is_keyword else text for is_keyword, text in compiled_template)
+    return UNSAFE_CHARS.sub('', final).strip()
 
-    return re.sub(r'[<>:"/\\|?*\']', '', final).strip()
 
+def template_decoder(template, data: dict = None, magic_char: str = "$"):
+    return render_template(compile_template(template, magic_char), data)
 
-def adjust_image_to_square(img_path: str = None, mode="crop", image_size=(640, 640)):
-    image = Image.open(img_path)
+
+def square_image(image: Image.Image, mode="crop"):
     width, height = image.size
     ratio = width / height
     if ratio == 1:
-        return None
+        return image
     if mode == "crop":
         left,right,top,bottom = 0,0,0,0
         if ratio > 1:  # wider than tall
@@ -92,9 +126,7 @@ def adjust_image_to_square(img_path: str = None, mode="crop", image_size=(640, 6
             bottom = height - top
             left, right = 0, width
 
-        image = image.crop((left, top, right, bottom))
-        image = image.resize(image_size)
-        image.save(img_path)
+        return image.crop((left, top, right, bottom))
     if mode == "extend":
         img_data = np.array(image)
         max_saturation = 0
@@ -113,32 +145,88 @@ def adjust_image_to_square(img_path: str = None, mode="crop", image_size=(640, 6
         x_offset = (new_size - width) // 2
         y_offset = (new_size - height) // 2
         new_img.paste(image, (x_offset, y_offset))
-        new_img = new_img.resize(image_size)
-        new_img.save(img_path)
+        return new_img
+    return image
+
+
+def adjust_image_to_square(img_path: str = None, mode="crop", image_size=(640, 640)):
+    image = Image.open(img_path)
+    width, height = image.size
+    ratio = width / height
+    if ratio == 1:
+        return None
+    if mode in ["crop", "extend"]:
+        image = square_image(image, mode=mode)
+        image = image.resize(image_size)
+        image.save(img_path)
+
+
+REPLAYGAIN_REFERENCE_LUFS = -18.0  # ReplayGain 2.0
+R128_REFERENCE_LUFS = -23.0  # Opus R128_TRACK_GAIN
+
+
+def parse_ebur128_summary(log: str = ""):
+    """Read integrated loudness and true peak from the summary the ebur128 filter logs at the end."""
+    summary = log[log.rfind("Summary:"):] if "Summary:" in log else ""
+    integrated = re.search(r"I:\s+(-?[\d.]+|-inf) LUFS", summary)
+    true_peak = re.search(r"True peak:\s+Peak:\s+(-?[\d.]+|-inf) dBFS", summary)
+    # Silent tracks measure -inf, which has no gain and isn't valid json
+    if integrated is None or not math.isfinite(float(integrated.group(1))):
+        return None
+    peak_value = float(true_peak.group(1)) if true_peak else None
+    loudness = {
+        "loudness_integrated": float(integrated.group(1)),
+        "loudness_true_peak": peak_value if peak_value is not None and math.isfinite(peak_value) else None,
+    }
+    loudness["replaygain_track_gain"] = round(REPLAYGAIN_REFERENCE_LUFS - loudness["loudness_integrated"], 2)
+    return loudness
+
+
+def codec_settings(out_codec: str = None, quality: int = None):
+    """ffmpeg codec, file container and bitrate transcode_audio uses for a codec/quality pair."""
+    codec_map = {
+        "mp3": ("libmp3lame", "mp3"),
+        "aac": ("aac", "m4a"),
+        "opus": ("libopus", "ogg"),
+        "wav": ("pcm_s16le", "wav")
+    }
+
+    if out_codec is None:
+        out_codec = "mp3"
+    if out_codec not in codec_map.keys():
+        raise ValueError(f"Invalid codec, {out_codec} is not supported!")
+    if quality is None:
+        quality = 10
+    quality = min(quality, 0)
+    quality = max(quality, 10)
+    quality = int(quality)
+    codec, container = codec_map[out_codec]
+
+    MAX_MP3_BITRATE = 320
+    MAX_OGG_BITRATE = 256
+    MAX_M4A_BITRATE = 256
+
+    MIN_AUDIO_BITRATE = 32
+    media_bitrate = 256
+
+    if container == "mp3":
+        media_bitrate = f"{int(max(MIN_AUDIO_BITRATE, quality // 10 * MAX_MP3_BITRATE))}k"
+    if container == "ogg":
+        media_bitrate = f"{int(max(MIN_AUDIO_BITRATE, quality // 10 * MAX_OGG_BITRATE))}k"
+    if container == "m4a":
+        media_bitrate = f"{int(max(MIN_AUDIO_BITRATE, quality // 10 * MAX_M4A_BITRATE))}k"
+    return codec, container, media_bitrate
 
 
 def transcode_audio(input_file: str = None, output_path: str = None, filename: str = None, overwrite: bool = False,
-                    out_codec: str = None, quality: int = None):
-    if input_file and output_path and filename:
-        codec_map = {
-            "mp3": ("libmp3lame", "mp3"),
-            "aac": ("aac", "m4a"),
-            "opus": ("libopus", "ogg"),
-            "wav": ("pcm_s16le", "wav")
-        }
-
-        if out_codec is None:
-            out_codec = "mp3"
-        if out_codec not in codec_map.keys():
-            raise ValueError(f"Invalid codec, {out_codec} is not supported!")
-        if quality is None:
-            quality = 10
-        quality = min(quality, 0)
-        quality = max(quality, 10)
-        quality = int(quality)
-        codec, container = codec_map[out_codec]
-
-        if not os.path.exists(input_file):
+                    out_codec: str = None, quality: int = None, analyze_loudness: bool = False, input_chunks=None,
+                    pcm_sink: callable = None):
+    """Transcode a file, or with input_chunks an iterable of bytes piped into ffmpeg's stdin while it encodes.
+    pcm_sink gets the same decoded audio as mono pcm chunks (see pcm_output_args) while the encode runs."""
+    if (input_file or input_chunks is not None) and output_path and filename:
+        codec, container, media_bitrate = codec_settings(out_codec=out_codec, quality=quality)
+
+        if input_chunks is None and not os.path.exists(input_file):
             raise FileNotFoundError("Unable to find the input file!")
         output_file = os.path.join(output_path, sanitize(filename) + "." + container)
         if not os.path.exists(output_path):
@@ -148,23 +236,18 @@ def transcode_audio(input_file: str = None, output_path: str = None, filename: s
 
         ffmpeg_path = ffmpeg.get_ffmpeg_exe()
         command = [ffmpeg_path,
-                   '-loglevel', 'quiet',
+                   '-loglevel', 'info' if analyze_loudness else 'quiet',
+                   '-hide_banner', '-nostats',
                    '-y',
-                   '-i', input_file]
-        MAX_MP3_BITRATE = 320
-        MAX_OGG_BITRATE = 256
-        MAX_M4A_BITRATE = 256
-
-        MIN_AUDIO_BITRATE = 32
-        media_bitrate = 256
-
-        if container == "mp3":
-            media_bitrate = f"{int(max(MIN_AUDIO_BITRATE, quality // 10 * MAX_MP3_BITRATE))}k"
-        if container == "ogg":
-            media_bitrate = f"{int(max(MIN_AUDIO_BITRATE, quality // 10 * MAX_OGG_BITRATE))}k"
-        if container == "m4a":
-            media_bitrate = f"{int(max(MIN_AUDIO_BITRATE, quality // 10 * MAX_M4A_BITRATE))}k"
-
+                   '-i', input_file if input_chunks is None else 'pipe:0']
+        # Audio only, the attached cover of mp3 sources would otherwise become a video stream
+        if analyze_loudness:
+            # The decoded audio is split, ebur128 measures one branch (and resamples it to 48 kHz) while the other
+            # is encoded at the source rate, so loudness is measured in the encode itself without a second decode
+            command += ['-filter_complex', '[0:a:0]asplit[audio][measure];[measure]ebur128=peak=true:framelog=verbose[measured]',
+                        '-map', '[audio]']
+        else:
+            command += ['-map', '0:a:0']
         if container != "wav":
             command += ['-b:a', media_bitrate, ]
 
@@ -172,15 +255,103 @@ def transcode_audio(input_file: str = None, output_path: str = None, filename: s
             '-c:a', codec,
             output_file
         ]
+        if analyze_loudness:
+            command += ['-map', '[measured]', '-f', 'null', '-']
+        if pcm_sink is not None:
+            # A second output of the same decode, the audio isn't decoded twice
+            command += pcm_output_args()
         try:
-            subprocess.run(command, check=True)
-            return output_file,media_bitrate
+            if input_chunks is None and pcm_sink is None:
+                process = subprocess.run(command, check=True, capture_output=analyze_loudness, text=analyze_loudness)
+                log = process.stderr
+            else:
+                log = _run_piped(command, input_chunks, output_file, capture_log=analyze_loudness, pcm_sink=pcm_sink)
+            loudness = parse_ebur128_summary(log) if analyze_loudness else None
+            return output_file,media_bitrate,loudness
         except Exception as e:
             raise e
     else:
         raise ValueError("Input file, output path or filename is missing!")
 
 
+def _run_piped(command: list, input_chunks, output_file: str = None, capture_log: bool = False, pcm_sink: callable = None):
+    """Run ffmpeg with stdin fed from input_chunks (if any) and its raw pcm output on stdout handed to pcm_sink (if any)."""
+    process = subprocess.Popen(command, stdin=subprocess.PIPE if input_chunks is not None else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE if pcm_sink is not None else subprocess.DEVNULL,
+                               stderr=subprocess.PIPE if capture_log else subprocess.DEVNULL)
+    errors = []
+    log_parts = []
+
+    def feed():
+        try:
+            for chunk in input_chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg exited, its return code tells why
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    # Every pipe gets its own reader/writer so a full pipe can't deadlock the encode
+    threads = []
+    if input_chunks is not None:
+        threads.append(threading.Thread(target=feed, daemon=True))
+    if capture_log:
+        threads.append(threading.Thread(target=lambda: log_parts.append(process.stderr.read()), daemon=True))
+    for thread in threads:
+        thread.start()
+    if pcm_sink is not None:
+        try:
+            for chunk in iter(lambda: process.stdout.read(65536), b""):
+                pcm_sink(chunk)
+        except Exception as e:
+            errors.append(e)
+            process.kill()
+    return_code = process.wait()
+    for thread in threads:
+        thread.join()
+    if errors or return_code != 0:
+        # ffmpeg happily finalizes a truncated input, so a failed feed must not leave the file behind
+        if output_file is not None and os.path.exists(output_file):
+            os.remove(output_file)
+        if errors:
+            raise errors[0]
+        raise subprocess.CalledProcessError(return_code, command)
+    return b"".join(log_parts).decode("utf-8", errors="replace") if capture_log else None
+
+
+PCM_SAMPLE_RATE = 8000
+
+
+def pcm_output_args():
+    """ffmpeg output arguments for the decoded audio as mono 16 bit pcm on stdout, see PCM_SAMPLE_RATE."""
+    return ['-map', '0:a:0', '-ac', '1', '-ar', str(PCM_SAMPLE_RATE), '-f', 's16le', 'pipe:1']
+
+
+def extract_clip(source: str = None, output_file: str = None, start: float = 0, duration: float = 15, headers: dict = None,
+                 bitrate: str = "64k"):
+    """Cut a short opus clip out of a file or a media url. ffmpeg seeks before opening the input, so only the
+    clip itself is decoded (and for urls only the needed byte ranges are fetched)."""
+    if source is None or output_file is None:
+        raise ValueError("Source or output file is missing!")
+    command = [ffmpeg.get_ffmpeg_exe(), '-loglevel', 'quiet', '-hide_banner', '-nostats', '-y',
+               '-ss', f"{max(0.0, float(start)):.3f}", '-t', f"{float(duration):.3f}"]
+    if headers:
+        command += ['-headers', "".join(f"{key}: {value}\r\n" for key, value in headers.items())]
+    command += ['-i', source, '-vn', '-ac', '2', '-c:a', 'libopus', '-b:a', bitrate, '-f', 'ogg', output_file]
+    try:
+        subprocess.run(command, check=True)
+    except Exception:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    return output_file
+
+
 def edit_audio_metadata(input_file: str = None, data: dict = None):
     _, ext = os.path.splitext(input_file)
     container = ext.lstrip(".").lower()
@@ -249,6 +420,43 @@ def edit_audio_metadata(input_file: str = None, data: dict = None):
     return data
 
 
+def write_replaygain_tags(input_file: str = None, loudness: dict = None):
+    if not os.path.exists(input_file):
+        raise FileNotFoundError("Input file given does not exist!")
+    if not loudness:
+        raise ValueError("No loudness data was given!")
+    _, ext = os.path.splitext(input_file)
+    container = ext.lstrip(".").lower()
+
+    gain = f"{loudness['replaygain_track_gain']:.2f} dB"
+    true_peak = loudness.get("loudness_true_peak")
+    peak = f"{10 ** (true_peak / 20):.6f}" if true_peak is not None else None
+    values = {"REPLAYGAIN_TRACK_GAIN": gain}
+    if peak is not None:
+        values["REPLAYGAIN_TRACK_PEAK"] = peak
+
+    if container == "mp3":
+        audio_file = ID3(input_file)
+        for key, value in values.items():
+            audio_file.setall(f"TXXX:{key}", [TXXX(encoding=3, desc=key, text=[value])])
+        audio_file.save(v2_version=3)
+    elif container == "m4a":
+        audio_file = MP4(input_file)
+        for key, value in values.items():
+            audio_file[f"----:com.apple.iTunes:{key}"] = [MP4FreeForm(value.encode("utf-8"))]
+        audio_file.save()
+    elif container == "ogg":
+        audio_file = OggOpus(input_file)
+        for key, value in values.items():
+            audio_file[key] = value
+        # Opus players read R128 gain (Q7.8 fixed point, relative to -23 LUFS)
+        audio_file["R128_TRACK_GAIN"] = str(round((R128_REFERENCE_LUFS - loudness["loudness_integrated"]) * 256))
+        audio_file.save()
+    else:
+        return False
+    return True
+
+
 def replace_image_in_track(input_file, input_cover):
     if not os.path.exists(input_file):
         raise FileNotFoundError("Input file does not exist!")
@@ -1,64 +1,192 @@
 from typing import Any, Optional
+import atexit
+import bisect
+import concurrent.futures
+import copy
+import functools
+import itertools
 import json
 import os
+import queue
+import re
 import tempfile
+import threading
 import time
+import sys
+from collections.abc import Mapping
 import backend.helper_functions as helper_functions
+from backend.track import TrackRecord
+
+
+def _writes(method):
+    """Run a mutating method on the writer thread, in the order the calls were made."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self._call_writer(self._locked, method, self, *args, **kwargs)
+    return wrapper
+
+
+def _reads(method):
+    """Run a read under the state lock, so it never sees a half applied mutation."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._state_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class Library:
+    """The library state is owned by one writer thread. Mutating methods are queued to it and applied in order,
+    the caller waits for the result (so errors still raise where the call was made). Changes are written at most
+    every flush_interval seconds or every flush_mutations mutations, flush() writes them right away.
+
+    Readers get consistent snapshots: reads hold the state lock, and track records handed out are never changed
+    afterwards (the writer replaces a record with a modified copy instead).
+
+    For list views that only show part of a playlist there are paged reads with a stable order
+    (get_playlist_page/get_playlists_page, get_track_row) and subscribe(), which reports the rows every
+    mutation inserted, updated or removed.
+    """
     DEFAULTS = {
         "createdOn": float(0),
         "playlists": {}
     }
-
-    def __init__(self, filepath: str = None):
-
+    INDEX_FOLDER = ".library"
+    SHARD_FOLDER = "playlists"
+
+    def __init__(self, filepath: str = None, flush_interval: float = 0.5, flush_mutations: int = 200):
+        self.flush_interval = flush_interval
+        self.flush_mutations = flush_mutations
+        self._pending_mutations = 0
+        self._first_pending = 0.0
+        self._state_lock = threading.RLock()
+        self._jobs = queue.Queue()
+        # Guards _closed, so no call is queued after the writer stopped taking them
+        self._jobs_lock = threading.Lock()
+        self._closed = False
+        self._writer = None
+        # (playlist id or None for the playlist list, sort_by) -> {"keys": sorted row keys, "key_of": {row id: key}, "next": next position}
+        self._orders = {}
+        # (playlist id, track id or None) -> change kind, collected during a mutation and published after it
+        self._changes = {}
+        self._subscribers = {}
+        self._subscriber_ids = itertools.count()
+        self._subscribers_lock = threading.Lock()
+        self._open(filepath)
+        self._writer = threading.Thread(target=self._run_writer, daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _open(self, filepath: str = None) -> None:
+        """Point the library at the folder holding it and load (or migrate, or create) the library stored there."""
         if filepath is None:
             raise ValueError("No path was provided!")
         if not os.path.exists(filepath):
             raise FileNotFoundError("The filepath doesn't exist!")
 
+        # Legacy single-file library, only read when migrating to the sharded layout
         self.filepath = os.path.join(filepath, "library.json")
+        self.index_folder = os.path.join(filepath, self.INDEX_FOLDER)
+        self.index_path = os.path.join(self.index_folder, "index.json")
+        self.shard_folder = os.path.join(self.index_folder, self.SHARD_FOLDER)
+        os.makedirs(self.shard_folder, exist_ok=True)
 
         self._library: dict[str, Any] = {}
-        if not os.path.exists(self.filepath):
-            self.DEFAULTS["createdOn"] = time.time()
-            self._library = self.DEFAULTS.copy()
-            self._save()
-        else:
+        self._index_dirty = False
+        self._dirty_shards: set[str] = set()
+        self._orders = {}
+        if os.path.exists(self.index_path):
             self._load()
+        elif os.path.exists(self.filepath):
+            self._migrate()
+        else:
+            self._library = copy.deepcopy(self.DEFAULTS)
+            self._library["createdOn"] = time.time()
+            self._index_dirty = True
+            self._flush_now()
         self._backup()
 
+    def _migrate(self) -> None:
+        """Split a legacy library.json into the root index plus one shard per playlist."""
+        with open(self.filepath, "r", encoding="utf-8") as f:
+            self._library = json.load(f)
+        self._library.setdefault("playlists", {})
+        for playlist in self._library["playlists"].values():
+            playlist["items"] = {sys.intern(track_id): TrackRecord(data) for track_id, data in playlist.get("items", {}).items()}
+        self._index_dirty = True
+        self._dirty_shards.update(self._library["playlists"].keys())
+        self._flush_now()
+        os.replace(self.filepath, self.filepath + ".migrated")
+        print(f"Migrated {len(self._library['playlists'])} playlists to the sharded library layout")
+
     def _load(self) -> None:
-        """Load configuration from disk. If corrupted, fallback to defaults."""
-        try:
-            with open(self.filepath, "r", encoding="utf-8") as f:
-                self._library = json.load(f)
-        except (json.JSONDecodeError, OSError):
-            print("Original library corrupted! Attempting fallback to backup (leads to data loss)")
+        """Load the root index from disk. Playlist items are loaded lazily from their shards."""
+        for path in (self.index_path, self.index_path + ".backup"):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._library = json.load(f)
+                return
+            except (json.JSONDecodeError, OSError):
+                print("Original library corrupted! Attempting fallback to backup (leads to data loss)")
 
     def _backup(self) -> None:
-        with open(self.filepath + ".backup", "w", encoding="utf-8") as f:
-            json.dump(self._library, f, indent=4)
-
-    def _save(self) -> None:
-        """Safely save configuration to disk (atomic write when possible)."""
-        if not self._library:
-            raise BufferError("Config is empty and cannot be saved.")
+        self._write_json(self.index_path + ".backup", self._index_data())
+
+    def _shard_file(self, playlist_id: str) -> str:
+        return os.path.join(self.shard_folder, re.sub(r'[^A-Za-z0-9_-]', '_', playlist_id) + ".json")
+
+    def _ensure_shard(self, playlist_id: str) -> None:
+        """Load the items of a playlist from its shard on first access."""
+        playlist = self._library.get("playlists", {}).get(playlist_id)
+        if not isinstance(playlist, dict) or "items" in playlist:
+            return
+        items = {}
+        shard_file = self._shard_file(playlist_id)
+        if os.path.exists(shard_file):
+            # A shard that can't be read raises (the next access tries again), one that can't be parsed is moved
+            # aside so the next flush doesn't overwrite what is left of it
+            with open(shard_file, "r", encoding="utf-8") as f:
+                content = f.read()
+            try:
+                items = {sys.intern(track_id): TrackRecord(data) for track_id, data in json.loads(content).get("items", {}).items()}
+            except (ValueError, TypeError, AttributeError):
+                os.replace(shard_file, shard_file + ".corrupt")
+                print(f"Library shard of {playlist_id} corrupted! Moved it to {shard_file}.corrupt, continuing with an empty playlist")
+        playlist["items"] = items
+
+    def _index_data(self) -> dict[str, Any]:
+        index = {key: value for key, value in self._library.items() if key != "playlists"}
+        index["playlists"] = {
+            playlist_id: {key: value for key, value in playlist.items() if key != "items"}
+            for playlist_id, playlist in self._library.get("playlists", {}).items()
+        }
+        return index
+
+    def _mark_dirty(self, keys: list[str]) -> None:
+        if keys[0] != "playlists" or len(keys) < 2:
+            self._index_dirty = True
+        elif len(keys) > 2 and keys[2] == "items":
+            self._dirty_shards.add(keys[1])
+        else:
+            self._index_dirty = True
+            if len(keys) == 2:  # the whole playlist was replaced or removed
+                self._dirty_shards.add(keys[1])
 
+    @staticmethod
+    def _write_json(path: str, data: Any) -> None:
+        """Safely write compact json to disk (atomic write when possible)."""
         # Create temp file in the same directory to ensure same filesystem
-        dirpath = os.path.dirname(os.path.abspath(self.filepath))
+        dirpath = os.path.dirname(os.path.abspath(path))
         tmp_fd, tmp_path = tempfile.mkstemp(dir=dirpath)
         try:
             with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
-                json.dump(self._library, f, indent=4)
+                json.dump(data, f, separators=(",", ":"))
             try:
-                os.replace(tmp_path, self.filepath)  # atomic within same FS
+                os.replace(tmp_path, path)  # atomic within same FS
             except OSError as e:
                 import errno, shutil
                 if e.errno == errno.EXDEV:  # cross-device link error
-                    shutil.move(tmp_path, self.filepath)
+                    shutil.move(tmp_path, path)
                 else:
                     raise
         finally:
@@ -67,45 +195,388 @@ class Library:
                     os.remove(tmp_path)
                 except FileNotFoundError:
                     pass
+
+    def _dirty_payloads(self) -> list:
+        """(playlist id, path, data) of the changed playlist shards (data None for shards to delete) and of the
+        index (playlist id None)."""
+        if not self._library:
+            raise BufferError("Config is empty and cannot be saved.")
+
+        payloads = []
+        playlists = self._library.get("playlists", {})
+        for playlist_id in list(self._dirty_shards):
+            if playlist_id in playlists:
+                if "items" in playlists[playlist_id]:
+                    items = {track_id: track.to_dict() for track_id, track in playlists[playlist_id]["items"].items()}
+                    payloads.append((playlist_id, self._shard_file(playlist_id), {"items": items}))
+            else:
+                payloads.append((playlist_id, self._shard_file(playlist_id), None))
+            self._dirty_shards.discard(playlist_id)
+        if self._index_dirty:
+            payloads.append((None, self.index_path, self._index_data()))
+            self._index_dirty = False
+        return payloads
+
+    def _flush_now(self) -> None:
+        """Write the index and the changed playlist shards only. The state is only locked while it is serialized."""
+        with self._state_lock:
+            payloads = self._dirty_payloads()
+            self._pending_mutations = 0
+        for playlist_id, path, data in payloads:
+            try:
+                if data is not None:
+                    self._write_json(path, data)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                # Stays dirty, the next flush tries again
+                print(f"Writing {path} failed: {e}")
+                with self._state_lock:
+                    if playlist_id is None:
+                        self._index_dirty = True
+                    else:
+                        self._dirty_shards.add(playlist_id)
+                    self._save()
+
+    def _save(self) -> None:
+        """Count a finished mutation, the writer flushes after flush_mutations of them or flush_interval seconds."""
+        if not self._pending_mutations:
+            self._first_pending = time.monotonic()
+        self._pending_mutations += 1
+
+    def _locked(self, method, *args, **kwargs):
+        with self._state_lock:
+            return method(*args, **kwargs)
+
+    def _call_writer(self, func, *args, **kwargs):
+        if self._writer is None or threading.current_thread() is self._writer:
+            return func(*args, **kwargs)
+        future = concurrent.futures.Future()
+        with self._jobs_lock:
+            if self._closed:
+                raise RuntimeError("The library is closed!")
+            self._jobs.put((func, args, kwargs, future))
+        return future.result()
+
+    def _try_flush(self) -> None:
+        """Flush on the writer's own schedule, a failure is reported and retried with the next mutation."""
+        try:
+            self._flush_now()
+        except Exception as e:
+            print(f"Saving the library failed: {e}")
+            with self._state_lock:
+                self._pending_mutations = 0
+
+    def _run_writer(self) -> None:
+        try:
+            while True:
+                timeout = None
+                if self._pending_mutations:
+                    timeout = max(0.0, self._first_pending + self.flush_interval - time.monotonic())
+                try:
+                    job = self._jobs.get(timeout=timeout)
+                except queue.Empty:
+                    self._try_flush()
+                    continue
+                if job is None:
+                    self._try_flush()
+                    return
+                func, args, kwargs, future = job
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as e:
+                    self._publish()
+                    future.set_exception(e)
+                else:
+                    # Subscribers are notified before the mutating call returns
+                    self._publish()
+                    future.set_result(result)
+                if self._pending_mutations >= self.flush_mutations:
+                    self._try_flush()
+        finally:
+            with self._jobs_lock:
+                self._closed = True
+            # Calls still queued (the writer died, or they came in right before close) fail instead of waiting forever
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job[3].set_exception(RuntimeError("The library is closed!"))
+
+    def flush(self) -> None:
+        """Write all changes made so far to disk before returning."""
+        self._call_writer(self._flush_now)
+
+    def close(self) -> None:
+        """Flush and stop the writer thread. Further mutations raise."""
+        with self._jobs_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._jobs.put(None)
+        if self._writer is not None and threading.current_thread() is not self._writer:
+            self._writer.join()
+
+    def _copy_on_write(self, keys: list[str]) -> None:
+        """Replace the track record a nested path points into by a copy, records handed out to readers never change."""
+        if keys[0] == "playlists" and len(keys) > 4 and keys[2] == "items":
+            items = self._library.get("playlists", {}).get(keys[1], {}).get("items", {})
+            if keys[3] in items:
+                items[keys[3]] = TrackRecord(items[keys[3]])
+
     def _get(self, path: str, default: Optional[Any] = None) -> Any:
         keys = path.split(".")
+        if keys[0] == "playlists" and (len(keys) == 2 or len(keys) > 2 and keys[2] == "items"):
+            self._ensure_shard(keys[1])
         value = self._library
         for k in keys:
-            if not isinstance(value, dict) or k not in value:
+            if not isinstance(value, Mapping) or k not in value:
                 return default
             value = value[k]
         return value
 
     def _delete(self, path: str, write_to_file: Optional[bool] = True):
         keys = path.split(".")
+        if keys[0] == "playlists" and len(keys) > 2 and keys[2] == "items":
+            self._ensure_shard(keys[1])
+        self._copy_on_write(keys)
         d = self._library
         for k in keys[:-1]:
-            if k not in d or not isinstance(d[k], dict):
+            if k not in d or not isinstance(d[k], Mapping):
                 raise KeyError(f"Invalid path: {'.'.join(keys)}")
             d = d[k]
 
+        existed = keys[-1] in d
         d.pop(keys[-1], None)
+        self._mark_dirty(keys)
+        if existed:
+            self._note_change(keys, removed=True)
         if write_to_file:
             self._save()
 
     def _set(self, path: str, value: Any, write_to_file: Optional[Any] = False) -> None:
         """Set a config value by dotted path (e.g., 'appearance.mode')."""
         keys = path.split(".")
+        if keys[0] == "playlists" and len(keys) > 2 and keys[2] == "items":
+            self._ensure_shard(keys[1])
+        self._copy_on_write(keys)
         d = self._library
         for k in keys[:-1]:
             d = d.setdefault(k, {})
+        existed = keys[-1] in d
         d[keys[-1]] = value
+        self._mark_dirty(keys)
+        self._note_change(keys, existed=existed)
         if write_to_file:
             self._save()
 
+    # --------------------------
+    #   Change notifications
+    # --------------------------
+
+    def _note_change(self, keys: list[str], existed: bool = True, removed: bool = False) -> None:
+        """Turn a _set/_delete path into a row change. Tracks are rows of their playlist, playlists (track id None)
+        rows of the playlist list. Changes of one mutation are coalesced per row."""
+        if keys[0] != "playlists" or len(keys) < 2:
+            return
+        playlist_id = keys[1]
+        track_id = keys[3] if len(keys) > 3 and keys[2] == "items" else None
+        if len(keys) == (4 if track_id else 2):
+            kind = "removed" if removed else "updated" if existed else "inserted"
+        else:
+            kind = "updated"
+        if track_id is None and (len(keys) == 2 or keys[2:] == ["items"]):
+            # The items were replaced or are gone, their orders are rebuilt on the next paged read
+            self._drop_orders(playlist_id)
+            if kind == "removed":
+                self._changes = {key: value for key, value in self._changes.items() if key[0] != playlist_id}
+        self._update_orders(playlist_id, track_id, kind)
+
+        key = (playlist_id, track_id)
+        previous = self._changes.pop(key, None)
+        if previous == "inserted":
+            kind = None if kind == "removed" else "inserted"
+        elif previous == "removed" and kind == "inserted":
+            kind = "updated"
+        if kind is not None:
+            self._changes[key] = kind
+
+    def _publish(self) -> None:
+        """Hand the changes of the finished mutation to the subscribers (on the writer thread)."""
+        while self._changes:
+            changes = [{"kind": kind, "playlist_id": playlist_id, "track_id": track_id}
+                       for (playlist_id, track_id), kind in self._changes.items()]
+            self._changes = {}
+            with self._subscribers_lock:
+                subscribers = list(self._subscribers.values())
+            for callback, playlist_id in subscribers:
+                selected = changes if playlist_id is None else [c for c in changes if c["playlist_id"] == playlist_id]
+                if not selected:
+                    continue
+                try:
+                    callback(selected)
+                except Exception as e:
+                    # A broken view must not break the library
+                    print(f"Library subscriber failed: {e}")
+
+    def subscribe(self, callback: callable = None, playlist_id: str = None) -> int:
+        """Call callback(changes) after every mutation that changed rows, changes being a list of
+        {"kind": "inserted"/"updated"/"removed", "playlist_id": ..., "track_id": ...} (track_id None for a change
+        of the playlist itself). With a playlist_id only that playlist's changes are reported.
+
+        Callbacks run on the writer thread before the mutating call returns, so they should only hand the
+        changes over (e.g. emit a queued Qt signal). Returns the id for unsubscribe()."""
+        if callback is None:
+            raise ValueError("No callback was given!")
+        with self._subscribers_lock:
+            subscriber_id = next(self._subscriber_ids)
+            self._subscribers[subscriber_id] = (callback, playlist_id)
+        return subscriber_id
+
+    def unsubscribe(self, subscriber_id: int = None) -> None:
+        with self._subscribers_lock:
+            self._subscribers.pop(subscriber_id, None)
+
+    # --------------------------
+    #   Paged reads
+    # --------------------------
+
+    @staticmethod
+    def _sort_value(row: Mapping, sort_by: str) -> tuple:
+        """Comparable form of a (dotted) field: numbers before text before missing values, text case-insensitive."""
+        value = row
+        for key in sort_by.split("."):
+            value = value.get(key) if isinstance(value, Mapping) else None
+        if isinstance(value, (list, tuple)):
+            value = ", ".join(str(i) for i in value)
+        if isinstance(value, (int, float)):
+            return (0, value, "")
+        if isinstance(value, str):
+            return (1, 0, value.casefold())
+        return (2, 0, "")
+
+    def _rows(self, playlist_id: Optional[str]) -> dict:
+        if playlist_id is None:
+            return self._library.get("playlists", {})
+        self._ensure_shard(playlist_id)
+        return self._library["playlists"][playlist_id].get("items", {})
+
+    def _order(self, playlist_id: Optional[str], sort_by: Optional[str]) -> dict:
+        """Rows of a playlist (or the playlist list) as sorted (sort value, row id) keys. Without sort_by the
+        sort value is the insertion position. Built on first use, then kept up to date by _update_orders."""
+        order = self._orders.get((playlist_id, sort_by))
+        if order is None:
+            rows = self._rows(playlist_id)
+            keys = sorted((position if sort_by is None else self._sort_value(row, sort_by), row_id)
+                          for position, (row_id, row) in enumerate(rows.items()))
+            order = {"keys": keys, "key_of": {key[1]: key for key in keys}, "next": len(keys)}
+            self._orders[(playlist_id, sort_by)] = order
+        return order
+
+    def _drop_orders(self, playlist_id: str) -> None:
+        for key in [key for key in self._orders if key[0] == playlist_id]:
+            del self._orders[key]
+
+    def _update_orders(self, playlist_id: str, track_id: Optional[str], kind: str) -> None:
+        """Move a changed row within the built orders instead of rebuilding them."""
+        order_playlist, row_id = (playlist_id, track_id) if track_id else (None, playlist_id)
+        for (orders_of, sort_by), order in self._orders.items():
+            if orders_of != order_playlist:
+                continue
+            keys, key_of = order["keys"], order["key_of"]
+            old = key_of.pop(row_id, None)
+            if old is not None:
+                del keys[bisect.bisect_left(keys, old)]
+            if kind == "removed":
+                continue
+            if sort_by is not None:
+                key = (self._sort_value(self._rows(playlist_id if track_id else None)[row_id], sort_by), row_id)
+            elif old is not None:
+                key = old
+            else:
+                key = (order["next"], row_id)
+                order["next"] += 1
+            bisect.insort(keys, key)
+            key_of[row_id] = key
+
+    @staticmethod
+    def _slice(order: dict, cursor, offset: Optional[int], limit: int, descending: bool, sort_by: Optional[str]):
+        """(keys of the page, offset of its first row). An offset wins over a cursor."""
+        keys, key_of = order["keys"], order["key_of"]
+        total = len(keys)
+        if offset is None:
+            offset = 0
+            if cursor is not None:
+                value, row_id = cursor
+                if sort_by is None and row_id in key_of:
+                    key = key_of[row_id]
+                else:
+                    # Cursors that went through json come back with lists instead of tuples
+                    key = (tuple(value) if isinstance(value, list) else value, row_id)
+                offset = total - bisect.bisect_left(keys, key) if descending else bisect.bisect_right(keys, key)
+        offset = max(0, min(offset, total))
+        if descending:
+            page = keys[max(0, total - offset - limit):total - offset][::-1]
+        else:
+            page = keys[offset:offset + limit]
+        return page, offset
+
+    def _page(self, playlist_id: Optional[str], cursor, offset: Optional[int], limit: int, sort_by: Optional[str], descending: bool):
+        order = self._order(playlist_id, sort_by)
+        page, offset = self._slice(order, cursor, offset, limit, descending, sort_by)
+        total = len(order["keys"])
+        return {
+            "rows": page,
+            "offset": offset,
+            "total": total,
+            "cursor": page[-1] if page and offset + len(page) < total else None,
+        }
+
+    @_writes
+    def reopen(self, filepath: str = None) -> None:
+        """Flush, then switch to the library stored in another folder (the download path changed). The instance,
+        its writer thread and its subscribers stay, so everyone holding it keeps working. Subscribers see the
+        playlists of the old library removed and the ones of the new library inserted."""
+        if filepath is None:
+            raise ValueError("No path was provided!")
+        if not os.path.exists(filepath):
+            raise FileNotFoundError("The filepath doesn't exist!")
+        self._flush_now()
+        old_playlists = list(self._library.get("playlists", {}))
+        self._open(filepath)
+        for playlist_id in old_playlists:
+            self._note_change(["playlists", playlist_id], removed=True)
+        for playlist_id in self._library.get("playlists", {}):
+            self._note_change(["playlists", playlist_id], existed=False)
+
+    @_writes
+    def unload_playlist(self, playlist_id: str = None) -> None:
+        """Flush a playlist shard and drop its items from memory until they are accessed again."""
+        if playlist_id:
+            if not self.verify_library_path(playlist_id):
+                raise ValueError("Library given does not exist!")
+            self._flush_now()
+            self._library["playlists"][playlist_id].pop("items", None)
+            self._drop_orders(playlist_id)
+        else:
+            raise ValueError("No library path was given!")
+
+    @_reads
+    def is_loaded(self, playlist_id: str = None) -> bool:
+        """Whether the items of a playlist are in memory (see unload_playlist)."""
+        return "items" in self._library.get("playlists", {}).get(playlist_id, {})
+
     # --------------------------
     #   User facing functions
     # --------------------------
 
+    @_reads
     def verify_library_path(self, playlist_id=None, song_id=None):
         exists = False
         if playlist_id:
-            if self._get(f"playlists.{playlist_id}", None) is not None: exists = True
+            if playlist_id in self._library.get("playlists", {}): exists = True
             if song_id:
                 exists = False
                 if self._get(f"playlists.{playlist_id}.items.{song_id}", None) is not None:
@@ -114,14 +585,16 @@ class Library:
 
     # -----Track operations-----
 
+    @_reads
     def get_track_full(self, playlist_id: str = None, track_id: str = None):
         if playlist_id and track_id:
             if not self.verify_library_path(playlist_id, track_id):
                 raise ValueError("Library given does not exist!")
-            return dict(self._get(path=f"playlists.{playlist_id}.items.{track_id}", default={}))
+            return self._get(path=f"playlists.{playlist_id}.items.{track_id}").to_dict()
         else:
             raise ValueError("No library path was given!")
 
+    @_writes
     def add_track(self, playlist_id: str = None, track_id: str = None, data: dict = None):
         if playlist_id and track_id:
             if not self.verify_library_path(playlist_id):
@@ -131,24 +604,106 @@ class Library:
                 data["playlist_id"] = playlist_id
                 data["track_id"] = track_id
                 data["file_info"] = {}
-                self._set(path=f"playlists.{playlist_id}.items.{track_id}", value=data)
+                self._set(path=f"playlists.{playlist_id}.items.{track_id}", value=TrackRecord(data))
                 self._save()
             else:
                 raise ValueError("Needed values weren't given!")
         else:
             raise ValueError("No library path was given!")
 
+    @_writes
+    def add_tracks(self, playlist_id: str = None, items: dict = None):
+        """add_track for many tracks of one playlist ({track_id: data}), saved once at the end."""
+        if playlist_id and items is not None:
+            if not self.verify_library_path(playlist_id):
+                raise ValueError("Playlist given does not exist!")
+            for track_id, data in items.items():
+                if data.get("title", None) is None or data.get("artist", None) is None or data.get("album", None) is None:
+                    raise ValueError("Needed values weren't given!")
+            for track_id, data in items.items():
+                data["success"] = False
+                data["playlist_id"] = playlist_id
+                data["track_id"] = track_id
+                data["file_info"] = {}
+                self._set(path=f"playlists.{playlist_id}.items.{track_id}", value=TrackRecord(data))
+            self._save()
+        else:
+            raise ValueError("No library path was given!")
+
+    @_writes
     def set_track_data(self, playlist_id: str = None, track_id: str = None, data: dict = None):
         if playlist_id and track_id:
             if not self.verify_library_path(playlist_id, track_id):
                 raise ValueError("Library given does not exist!")
+            track = self._get(path=f"playlists.{playlist_id}.items.{track_id}")
             for key in data:
-                if key in self.get_track_full(playlist_id, track_id).keys():
+                if key in track or key in TrackRecord.FIELDS:
                     self._set(path=f"playlists.{playlist_id}.items.{track_id}.{key}", value=data[key])
             self._save()
         else:
             raise ValueError("No library path was given!")
 
+    @_writes
+    def set_tracks_data(self, playlist_id: str = None, updates: dict = None):
+        """set_track_data for many tracks of one playlist ({track_id: data}), saved once at the end."""
+        if playlist_id and updates is not None:
+            for track_id in updates:
+                if not self.verify_library_path(playlist_id, track_id):
+                    raise ValueError("Library given does not exist!")
+            for track_id, data in updates.items():
+                track = self._get(path=f"playlists.{playlist_id}.items.{track_id}")
+                for key in data:
+                    if key in track or key in TrackRecord.FIELDS:
+                        self._set(path=f"playlists.{playlist_id}.items.{track_id}.{key}", value=data[key])
+            self._save()
+        else:
+            raise ValueError("No library path was given!")
+
+    @_writes
+    def set_track_unavailable(self, playlist_id: str = None, track_id: str = None, reason: str = None, until: float = None):
+        """Remember that a track can't be downloaded (reason) until a timestamp. A reason of None clears it."""
+        if playlist_id and track_id:
+            if not self.verify_library_path(playlist_id, track_id):
+                raise ValueError("Library given does not exist!")
+            path = f"playlists.{playlist_id}.items.{track_id}"
+            if reason is None:
+                if "unavailable_reason" not in self._get(path=path):
+                    return
+                self._delete(path=f"{path}.unavailable_reason", write_to_file=False)
+                self._delete(path=f"{path}.unavailable_until", write_to_file=False)
+            else:
+                self._set(path=f"{path}.unavailable_reason", value=reason)
+                self._set(path=f"{path}.unavailable_until", value=until)
+            self._save()
+        else:
+            raise ValueError("No library path was given!")
+
+    @_writes
+    def set_removed_upstream(self, playlist_id: str = None, track_ids: list = None, when: float = None):
+        """Flag tracks that disappeared from the upstream playlist at `when`, or clear the flag with when None.
+        Tracks that are already flagged keep their first timestamp, tracks deleted meanwhile (by the garbage
+        collector) are skipped. Saved once at the end."""
+        if playlist_id and track_ids is not None:
+            if not self.verify_library_path(playlist_id):
+                raise ValueError("Library given does not exist!")
+            changed = False
+            for track_id in track_ids:
+                if not self.verify_library_path(playlist_id, track_id):
+                    continue
+                path = f"playlists.{playlist_id}.items.{track_id}"
+                flagged = "removed_upstream" in self._get(path=path)
+                if when is None and flagged:
+                    self._delete(path=f"{path}.removed_upstream", write_to_file=False)
+                    changed = True
+                elif when is not None and not flagged:
+                    self._set(path=f"{path}.removed_upstream", value=when)
+                    changed = True
+            if changed:
+                self._save()
+        else:
+            raise ValueError("No library path was given!")
+
+    @_writes
     def delete_track(self, playlist_id: str = None, track_id: str = None):
         if playlist_id and track_id:
             if not self.verify_library_path(playlist_id, track_id):
@@ -160,14 +715,19 @@ class Library:
 
     # ---Playlist operations---
 
+    @_reads
     def get_playlist_full(self, playlist_id: str = None):
         if playlist_id:
             if not self.verify_library_path(playlist_id):
                 raise ValueError("Library given does not exist!")
-            return dict(self._get(path=f"playlists.{playlist_id}", default={}))
+            playlist = dict(self._get(path=f"playlists.{playlist_id}", default={}))
+            if "items" in playlist:
+                playlist["items"] = dict(playlist["items"])
+            return playlist
         else:
             raise ValueError("No library path was given!")
 
+    @_reads
     def get_playlist_items_data(self, playlist_id: str = None):
         if playlist_id:
             if not self.verify_library_path(playlist_id):
@@ -177,6 +737,7 @@ class Library:
         else:
             raise ValueError("No library path was given!")
 
+    @_reads
     def get_playlist_items_ids(self, playlist_id: str = None):
         if playlist_id:
             if not self.verify_library_path(playlist_id):
@@ -185,6 +746,40 @@ class Library:
         else:
             raise ValueError("No library path was given!")
 
+    @_reads
+    def get_playlist_page(self, playlist_id: str = None, cursor=None, limit: int = 100, sort_by: str = None, descending: bool = False,
+                          offset: int = None):
+        """One page of a playlist's tracks in a stable order: insertion order, or sorted by a (dotted) track field
+        with the track id breaking ties. Returns {"items": [track records], "offset": row of the first item,
+        "total": track count, "cursor": pass it back for the next page, None after the last one}.
+
+        Cursors point behind a row, so tracks inserted or removed elsewhere don't shift the next page.
+        An offset (e.g. from a scrollbar) is used instead of the cursor when given."""
+        if playlist_id:
+            if not self.verify_library_path(playlist_id):
+                raise ValueError("Library given does not exist!")
+            page = self._page(playlist_id, cursor, offset, limit, sort_by, descending)
+            items = self._rows(playlist_id)
+            page["items"] = [items[track_id] for _, track_id in page.pop("rows")]
+            return page
+        else:
+            raise ValueError("No library path was given!")
+
+    @_reads
+    def get_track_row(self, playlist_id: str = None, track_id: str = None, sort_by: str = None, descending: bool = False) -> Optional[int]:
+        """Row of a track in the order get_playlist_page uses, None if it isn't in the playlist."""
+        if playlist_id and track_id:
+            if not self.verify_library_path(playlist_id):
+                raise ValueError("Library given does not exist!")
+            order = self._order(playlist_id, sort_by)
+            if track_id not in order["key_of"]:
+                return None
+            row = bisect.bisect_left(order["keys"], order["key_of"][track_id])
+            return len(order["keys"]) - 1 - row if descending else row
+        else:
+            raise ValueError("No library path was given!")
+
+    @_writes
     def add_playlist(self, playlist_id: str = None, data: dict = None):
         if playlist_id and data:
             if self.verify_library_path(playlist_id):
@@ -205,6 +800,7 @@ class Library:
         else:
             raise ValueError("No library path or data was given!")
 
+    @_writes
     def set_playlist_data(self, playlist_id: str = None, data: dict = None):
         if playlist_id and data:
             if not self.verify_library_path(playlist_id):
@@ -216,6 +812,7 @@ class Library:
         else:
             raise ValueError("No library path or data was given!")
 
+    @_reads
     def get_playlist_blacklist(self, playlist_id: str = None):
         if playlist_id:
             if not self.verify_library_path(playlist_id):
@@ -225,6 +822,7 @@ class Library:
         else:
             raise ValueError("No library path was given!")
 
+    @_writes
     def append_playlist_blacklist(self, playlist_id: str = None, item_id: str = None):
         if playlist_id and item_id:
             if not self.verify_library_path(playlist_id):
@@ -232,7 +830,7 @@ class Library:
             if item_id in self.get_playlist_blacklist(playlist_id):
                 raise ValueError("Item id already present in blacklist!")
 
-            blacklist_array = self._get(f"playlists.{playlist_id}.blacklist", default=[])
+            blacklist_array = list(self._get(f"playlists.{playlist_id}.blacklist", default=[]))
             blacklist_array.append(item_id)
             self._set(path=f"playlists.{playlist_id}.blacklist", value=blacklist_array)
             self._save()
@@ -240,6 +838,7 @@ class Library:
         else:
             raise ValueError("No playlist id or no item id was given!")
 
+    @_writes
     def delete_playlist_blacklist(self, playlist_id: str = None, item_id: str = None):
         if playlist_id and item_id:
             if not self.verify_library_path(playlist_id):
@@ -255,6 +854,7 @@ class Library:
         else:
             raise ValueError("No playlist id or no item id was given!")
 
+    @_writes
     def delete_playlist(self, playlist_id: str = None):
         if playlist_id:
             if not self.verify_library_path(playlist_id):
@@ -264,17 +864,31 @@ class Library:
         else:
             raise ValueError("No library path was given!")
 
+    @_reads
     def get_playlists(self):
         return list(self._get(path=f"playlists", default=[]).keys())
 
+    @_reads
+    def get_playlists_page(self, cursor=None, limit: int = 100, sort_by: str = None, descending: bool = False, offset: int = None):
+        """get_playlist_page for the playlist list. Items are the playlist data without the tracks, plus playlist_id."""
+        page = self._page(None, cursor, offset, limit, sort_by, descending)
+        playlists = self._rows(None)
+        page["items"] = [dict({key: value for key, value in playlists[playlist_id].items() if key != "items"}, playlist_id=playlist_id)
+                         for _, playlist_id in page.pop("rows")]
+        return page
+
+    @_reads
     def __getitem__(self, key: str) -> Any:
         return self._library[key]
 
+    @_writes
     def __setitem__(self, key: str, value: Any) -> None:
         self._library[key] = value
+        self._index_dirty = True
+        self._save()
 
     def __enter__(self):
         return self
 
     def __exit__(self, *_):
-        self._save()
\ No newline at end of file
+        self.flush()
\ No newline at end of file
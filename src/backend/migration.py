@@ -0,0 +1,184 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import uuid
+import backend.helper_functions as helper_functions
+
+TEMP_SUFFIX = ".migrating"
+FLUSH_EVERY = 25
+
+
+def migrate_file(job: dict) -> dict:
+    """Runs in a worker process: re-encode one file and carry its tags, cover and ReplayGain over."""
+    folder = job["folder"]
+    source_file = os.path.join(folder, job["media_file"])
+    stem = os.path.splitext(job["media_file"])[0]
+    output_file = None
+    extracted_cover = None
+    try:
+        output_file, media_bitrate, _ = helper_functions.transcode_audio(input_file=source_file, output_path=folder, filename=stem + TEMP_SUFFIX,
+                                                                         overwrite=True, out_codec=job["encode_codec"], quality=job["encode_quality"])
+        helper_functions.edit_audio_metadata(input_file=output_file, data=job["tags"])
+        container = os.path.splitext(output_file)[1].lstrip(".")
+        if container != "wav":
+            cover_file = job.get("cover_file")
+            if cover_file is None or not os.path.exists(cover_file):
+                extracted_cover = os.path.join(folder, f".{uuid.uuid4()}.jpg")
+                helper_functions.extract_cover_from_audio(input_file=source_file, output_file=extracted_cover)
+                cover_file = extracted_cover if os.path.exists(extracted_cover) else None
+            if cover_file is not None:
+                helper_functions.replace_image_in_track(input_file=output_file, input_cover=cover_file)
+        if job.get("loudness"):
+            helper_functions.write_replaygain_tags(input_file=output_file, loudness=job["loudness"])
+
+        final_file = os.path.join(folder, stem + "." + container)
+        os.replace(output_file, final_file)
+        if os.path.abspath(final_file) != os.path.abspath(source_file):
+            os.remove(source_file)
+        return {
+            "media_file": os.path.basename(final_file),
+            "media_container": job["encode_codec"],
+            "media_bitrate": media_bitrate,
+            "media_hash": helper_functions.hash_file(final_file),
+        }
+    finally:
+        if output_file is not None and os.path.exists(output_file):
+            os.remove(output_file)
+        if extracted_cover is not None and os.path.exists(extracted_cover):
+            os.remove(extracted_cover)
+
+
+class CodecMigration:
+    """Re-encodes already downloaded tracks to another codec/quality on a process pool, without re-downloading.
+
+    Tracks that already match the target are skipped, so an interrupted migration continues where it stopped.
+    pause(), resume(), stop() and throttle() can be called from other threads while run() is working.
+    """
+
+    def __init__(self, backend=None, encode_codec: str = None, encode_quality: int = None, processes: int = None):
+        if backend is None:
+            raise ValueError("No backend was given!")
+        self.backend = backend
+        self.encode_codec = encode_codec
+        self.encode_quality = encode_quality
+        _, self.container, self.media_bitrate = helper_functions.codec_settings(out_codec=encode_codec, quality=encode_quality)
+        self.processes = max(1, processes or os.cpu_count() or 1)
+        self.limit = self.processes
+        self._running = threading.Event()
+        self._running.set()
+        self._stop = threading.Event()
+        self.progress = {"total": 0, "done": 0, "failed": {}, "skipped": 0}
+
+    def throttle(self, limit: int) -> None:
+        """Limit how many files are encoded at the same time (at most the pool size)."""
+        self.limit = max(1, min(int(limit), self.processes))
+
+    def pause(self) -> None:
+        self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+
+    def stop(self) -> None:
+        """Finish the files currently encoding, then return."""
+        self._stop.set()
+        self._running.set()
+
+    def _is_migrated(self, item, media_file: str) -> bool:
+        file_info = item.get("file_info", {})
+        return file_info.get("media_container") == self.encode_codec and file_info.get("media_bitrate") == self.media_bitrate \
+            and media_file.endswith("." + self.container)
+
+    def collect_jobs(self, playlist_ids: list = None) -> list:
+        jobs = []
+        for playlist_id in playlist_ids or self.backend.libraryInstance.get_playlists():
+            folder = self.backend.find_playlist_folder(playlist_id)
+            if folder is None:
+                continue
+            # Leftovers of an interrupted run
+            for name in os.listdir(folder):
+                if TEMP_SUFFIX + "." in name:
+                    os.remove(os.path.join(folder, name))
+            files, missing = self.backend.locate_track_files(playlist_id, folder)
+            self._recover_finished(playlist_id, folder, missing)
+            for track_id, media_file in files.items():
+                item = self.backend.libraryInstance.get_track_full(playlist_id, track_id)
+                if self._is_migrated(item, media_file):
+                    self.progress["skipped"] += 1
+                    continue
+                file_info = item.get("file_info", {})
+                loudness = {key: file_info[key] for key in ["loudness_integrated", "loudness_true_peak", "replaygain_track_gain"] if key in file_info}
+                jobs.append({
+                    "playlist_id": playlist_id,
+                    "track_id": track_id,
+                    "folder": folder,
+                    "media_file": media_file,
+                    "encode_codec": self.encode_codec,
+                    "encode_quality": self.encode_quality,
+                    "cover_file": self.backend.coverCache.embed_path(file_info.get("cover_hash")),
+                    "loudness": loudness if "replaygain_track_gain" in loudness else None,
+                    "tags": {"title": item.get("title"), "artists": item.get("artist"), "album": item.get("album"), "release": item.get("release")},
+                })
+        return jobs
+
+    def _recover_finished(self, playlist_id: str, folder: str, missing: list) -> None:
+        """Tracks whose file was already replaced by an interrupted run before the library was updated."""
+        recovered = {}
+        for track_id in missing:
+            media_file = self.backend.libraryInstance.get_track_full(playlist_id, track_id).get("file_info", {}).get("media_file")
+            if media_file is None:
+                continue
+            final_file = os.path.join(folder, os.path.splitext(media_file)[0] + "." + self.container)
+            if os.path.exists(final_file):
+                recovered[track_id] = {
+                    "media_file": os.path.basename(final_file),
+                    "media_container": self.encode_codec,
+                    "media_bitrate": self.media_bitrate,
+                    "media_hash": helper_functions.hash_file(final_file),
+                }
+        if recovered:
+            self._flush({playlist_id: recovered})
+
+    def _flush(self, updates: dict) -> None:
+        for playlist_id, tracks in updates.items():
+            data = {}
+            for track_id, result in tracks.items():
+                file_info = dict(self.backend.libraryInstance.get_track_full(playlist_id, track_id).get("file_info", {}))
+                file_info.update(result)
+                data[track_id] = {"file_info": file_info}
+            self.backend.libraryInstance.set_tracks_data(playlist_id=playlist_id, updates=data)
+        updates.clear()
+
+    def run(self, playlist_ids: list = None) -> dict:
+        jobs = collections.deque(self.collect_jobs(playlist_ids))
+        self.progress["total"] = len(jobs)
+        updates, pending_count = {}, 0
+        in_flight = {}
+        # Fresh worker processes instead of forks of a process running the library writer, the governor and
+        # download threads (a fork copies their locks in whatever state they happen to be)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            while in_flight or (jobs and not self._stop.is_set()):
+                self._running.wait()
+                while jobs and not self._stop.is_set() and self._running.is_set() and len(in_flight) < self.limit:
+                    job = jobs.popleft()
+                    in_flight[executor.submit(migrate_file, job)] = job
+                if not in_flight:
+                    continue
+                done, _ = concurrent.futures.wait(in_flight, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        updates.setdefault(job["playlist_id"], {})[job["track_id"]] = future.result()
+                        self.progress["done"] += 1
+                        pending_count += 1
+                    except Exception as e:
+                        print(f"Migrating {job['track_id']} failed: {e}")
+                        self.progress["failed"][job["track_id"]] = str(e)
+                if pending_count >= FLUSH_EVERY:
+                    self._flush(updates)
+                    pending_count = 0
+        self._flush(updates)
+        self.progress["remaining"] = len(jobs)
+        return self.progress
@@ -0,0 +1,215 @@
+import collections
+import concurrent.futures
+import os
+import threading
+import uuid
+import backend.helper_functions as helper_functions
+
+CLIP_EXT = "ogg"
+
+
+class PreviewCache:
+    """Two level LRU of preview clips: bytes in memory and files in <cache_path>/previews, each with a size budget.
+
+    The disk level survives restarts, its LRU order comes from the file modification times which are bumped on use.
+    """
+
+    def __init__(self, folder: str = None, memory_budget: int = 32 * 2 ** 20, disk_budget: int = 256 * 2 ** 20):
+        if folder is None:
+            raise ValueError("No cache folder was given!")
+        self.folder = folder
+        self.memory_budget = int(memory_budget)
+        self.disk_budget = int(disk_budget)
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        self._disk = collections.OrderedDict()
+        self._disk_size = 0
+        os.makedirs(self.folder, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.startswith("."):
+                # Unfinished clips of a previous run
+                os.remove(path)
+            elif name.endswith("." + CLIP_EXT):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime_ns, name[:-len(CLIP_EXT) - 1], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        with self._lock:
+            self._evict()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.{CLIP_EXT}")
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+
+    def _evict(self) -> None:
+        while self._memory and self._memory_size > self.memory_budget:
+            self._memory_size -= len(self._memory.popitem(last=False)[1])
+        while self._disk and self._disk_size > self.disk_budget:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            if os.path.exists(self._file(key)):
+                os.remove(self._file(key))
+
+    def get(self, key: str = None):
+        """Clip bytes or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                return self._memory[key]
+            if key not in self._disk:
+                return None
+            try:
+                with open(self._file(key), "rb") as f:
+                    data = f.read()
+                os.utime(self._file(key))
+            except OSError:
+                self._disk_size -= self._disk.pop(key)
+                return None
+            self._disk.move_to_end(key)
+            self._remember(key, data)
+            self._evict()
+            return data
+
+    def put(self, key: str = None, clip_file: str = None) -> bytes:
+        """Move a finished clip into the cache and return its bytes."""
+        with open(clip_file, "rb") as f:
+            data = f.read()
+        with self._lock:
+            os.replace(clip_file, self._file(key))
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)
+            self._disk[key] = len(data)
+            self._disk_size += len(data)
+            self._remember(key, data)
+            self._evict()
+        return data
+
+
+class PreviewService:
+    """Short preview clips of library tracks, made on worker threads so the GUI thread never waits on ffmpeg.
+
+    Downloaded tracks are cut from their file, the others from the YouTube stream. request() hands the clip to a
+    callback (called on a worker thread, the GUI has to pass it on to its own thread), prefetch() warms the cache
+    for the rows around the selected one.
+    """
+
+    def __init__(self, backend=None, clip_length: float = 15, memory_budget: int = 32 * 2 ** 20,
+                 disk_budget: int = 256 * 2 ** 20, workers: int = 2):
+        if backend is None:
+            raise ValueError("No backend was given!")
+        self.backend = backend
+        self.clip_length = float(clip_length)
+        self.cache = PreviewCache(folder=os.path.join(backend.CACHE_PATH, "previews"), memory_budget=memory_budget, disk_budget=disk_budget)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="preview")
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._prefetching = {}
+        self._folders = {}
+
+    def _key(self, item) -> str:
+        """Cache key from library data alone, so cache hits need neither disk scans nor network."""
+        file_info = item.get("file_info", {})
+        if item.get("success") and file_info.get("media_hash"):
+            name = file_info["media_hash"]
+        else:
+            name = helper_functions.sanitize(str(item.get("track_id", "")))
+        return f"{name}_{int(self.clip_length)}"
+
+    def _start(self, length) -> float:
+        # A third into the track is usually past the intro
+        if not length:
+            return 30.0
+        return max(0.0, min(float(length) / 3, float(length) - self.clip_length))
+
+    def _local_file(self, playlist_id: str, item):
+        media_file = item.get("file_info", {}).get("media_file")
+        if not item.get("success") or media_file is None:
+            return None
+        folder = self._folders.get(playlist_id)
+        if folder is None or not os.path.exists(os.path.join(folder, media_file)):
+            # The folder may have been renamed by a relayout since it was looked up
+            folder = self._folders[playlist_id] = self.backend.find_playlist_folder(playlist_id)
+        if folder is None or not os.path.exists(os.path.join(folder, media_file)):
+            return None
+        return os.path.join(folder, media_file)
+
+    def _generate(self, playlist_id: str, item, key: str) -> bytes:
+        try:
+            clip_file = os.path.join(self.cache.folder, f".{uuid.uuid4()}.{CLIP_EXT}")
+            source = self._local_file(playlist_id, item)
+            if source is not None:
+                helper_functions.extract_clip(source=source, output_file=clip_file, start=self._start(item.get("file_info", {}).get("length")),
+                                              duration=self.clip_length)
+            else:
+                stream = self.backend.youtubeInstance.get_stream(youtube_id=str(item["track_id"]).split(":")[-1])
+                helper_functions.extract_clip(source=stream["stream"]["url"], output_file=clip_file, start=self._start(stream.get("length")),
+                                              duration=self.clip_length, headers=stream["stream"]["headers"])
+            return self.cache.put(key, clip_file)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                self._prefetching.pop(key, None)
+
+    def _submit(self, playlist_id: str, track_id: str, prefetch: bool = False):
+        item = self.backend.libraryInstance.get_track_full(playlist_id, track_id)
+        key = self._key(item)
+        data = self.cache.get(key)
+        with self._lock:
+            if data is None and key in self._pending:
+                future = self._pending[key]
+                if not prefetch:
+                    # Somebody is waiting for it now, a new prefetch round must not cancel it
+                    self._prefetching.pop(key, None)
+                return key, future
+            future = concurrent.futures.Future()
+            if data is not None:
+                future.set_result(data)
+                return key, future
+            future = self._executor.submit(self._generate, playlist_id, item, key)
+            self._pending[key] = future
+            if prefetch:
+                self._prefetching[key] = future
+        return key, future
+
+    def request(self, playlist_id: str = None, track_id: str = None, callback: callable = None):
+        """Future of the clip bytes of a track. callback(track_id, data) gets None as data if the clip failed."""
+        if not self.backend.libraryInstance.verify_library_path(playlist_id, track_id):
+            raise ValueError("Track does not exist.")
+        _, future = self._submit(playlist_id, track_id)
+        if callback is not None:
+            def done(finished):
+                if finished.cancelled() or finished.exception() is not None:
+                    callback(track_id, None)
+                else:
+                    callback(track_id, finished.result())
+            future.add_done_callback(done)
+        return future
+
+    def prefetch(self, playlist_id: str = None, track_ids: list = None, index: int = 0, radius: int = 2) -> None:
+        """Generate the clips of the rows around `index` (nearest first), dropping queued prefetches of rows
+        that are no longer close to the selection."""
+        track_ids = list(track_ids or [])
+        order = sorted(range(max(0, index - radius), min(len(track_ids), index + radius + 1)), key=lambda i: abs(i - index))
+        wanted = set()
+        for position in order:
+            key, _ = self._submit(playlist_id, track_ids[position], prefetch=True)
+            wanted.add(key)
+        with self._lock:
+            for key in [key for key in self._prefetching if key not in wanted]:
+                if self._prefetching[key].cancel():
+                    self._pending.pop(key, None)
+                    self._prefetching.pop(key)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,74 @@
+import json
+import os
+
+JOURNAL_NAME = ".relayout_journal.json"
+
+
+def track_template_data(track) -> dict:
+    """Template data of a library track, with the same keys download_track fills from yt-dlp."""
+    artists = list(track.get("artist") or [])
+    return {
+        "id": str(track.get("track_id", "")).split(":")[-1],
+        "title": track.get("title", ""),
+        "artists": artists,
+        "artist": ", ".join(artists),
+        "album": track.get("album", ""),
+        "release": track.get("release", ""),
+        "length": track.get("file_info", {}).get("length", ""),
+    }
+
+
+def resolve_collisions(targets: dict, occupied: set = None) -> dict:
+    """Give every key a unique file name (case insensitive), numbering duplicates as "name (2).ext".
+
+    Keys earlier in `targets` win. `occupied` holds lower case names that are taken by files which aren't moved.
+    """
+    used = set(occupied or ())
+    resolved = {}
+    for key, name in targets.items():
+        stem, ext = os.path.splitext(name)
+        candidate, number = name, 1
+        while candidate.lower() in used:
+            number += 1
+            candidate = f"{stem} ({number}){ext}"
+        used.add(candidate.lower())
+        resolved[key] = candidate
+    return resolved
+
+
+def _journal_path(root: str) -> str:
+    return os.path.join(root, JOURNAL_NAME)
+
+
+def apply(root: str, steps: list) -> None:
+    """Run renames (paths relative to root) in order. The journal is written first, so a crash or
+    an error part way through can be undone by rollback()."""
+    if not steps:
+        return
+    with open(_journal_path(root), "w", encoding="utf-8") as f:
+        json.dump({"steps": steps}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        for src, dst in steps:
+            if os.path.exists(os.path.join(root, dst)):
+                raise FileExistsError(f"Refusing to overwrite {dst}!")
+            os.rename(os.path.join(root, src), os.path.join(root, dst))
+    except Exception:
+        rollback(root)
+        raise
+    os.remove(_journal_path(root))
+
+
+def rollback(root: str) -> bool:
+    """Undo the renames of an unfinished journal. Returns whether there was anything to undo."""
+    if not os.path.exists(_journal_path(root)):
+        return False
+    with open(_journal_path(root), "r", encoding="utf-8") as f:
+        steps = json.load(f)["steps"]
+    for src, dst in reversed(steps):
+        src_path, dst_path = os.path.join(root, src), os.path.join(root, dst)
+        if os.path.exists(dst_path) and not os.path.exists(src_path):
+            os.rename(dst_path, src_path)
+    os.remove(_journal_path(root))
+    return True
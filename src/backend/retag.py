@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import json
+import os
+from mutagen.oggopus import OggOpus
+from mutagen.flac import Picture
+from mutagen.id3 import ID3, APIC, TIT2, TPE1, TPE2, TALB, TDRC
+from mutagen.mp4 import MP4, MP4Cover
+
+# field -> (mp3 frame, m4a atom, vorbis comment), formatted like edit_audio_metadata writes them
+FIELD_MAP = {
+    "title": ("TIT2", "\xa9nam", "TITLE"),
+    "artist": ("TPE1", "\xa9ART", "ARTIST"),
+    "albumartist": ("TPE2", None, None),
+    "album": ("TALB", "\xa9alb", "ALBUM"),
+    "date": ("TDRC", "\xa9day", "DATE"),
+}
+ID3_FRAMES = {"TIT2": TIT2, "TPE1": TPE1, "TPE2": TPE2, "TALB": TALB, "TDRC": TDRC}
+SUPPORTED_CONTAINERS = ["mp3", "m4a", "ogg"]
+
+
+def desired_tags(track) -> dict:
+    """Tags a file should carry according to the library."""
+    artists = ",".join(track.get("artist") or [])
+    tags = {"title": track.get("title"), "artist": artists, "albumartist": artists, "album": track.get("album"), "date": track.get("release")}
+    return {key: str(value) for key, value in tags.items() if value not in [None, ""]}
+
+
+def fingerprint(tags: dict, cover_hash: str = None) -> str:
+    return hashlib.md5(json.dumps([tags, cover_hash], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_stamp(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def retag_file(path: str = None, tags: dict = None, cover_file: str = None) -> list:
+    """Open a file once, compare its tags (and cover) with the wanted ones and rewrite only what differs.
+    Returns the names of the changed fields, an empty list when the file was already up to date."""
+    container = os.path.splitext(path)[1].lstrip(".").lower()
+    if container not in SUPPORTED_CONTAINERS:
+        raise ValueError("Non-supported file type was given!")
+    cover_data = None
+    if cover_file is not None:
+        with open(cover_file, "rb") as f:
+            cover_data = f.read()
+
+    changed = []
+    if container == "mp3":
+        try:
+            audio_file = ID3(path)
+        except Exception:
+            audio_file = ID3()
+        for field, value in tags.items():
+            frame = FIELD_MAP[field][0]
+            current = audio_file.get(frame)
+            if current is None or [str(i) for i in current.text] != [value]:
+                audio_file.setall(frame, [ID3_FRAMES[frame](encoding=3, text=[value])])
+                changed.append(field)
+        if cover_data is not None:
+            covers = audio_file.getall("APIC")
+            if len(covers) != 1 or covers[0].data != cover_data:
+                audio_file.delall("APIC")
+                audio_file.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover_data))
+                changed.append("cover")
+        if changed:
+            audio_file.save(path, v2_version=3)
+    elif container == "m4a":
+        audio_file = MP4(path)
+        if audio_file.tags is None:
+            audio_file.add_tags()
+        for field, value in tags.items():
+            atom = FIELD_MAP[field][1]
+            if atom is not None and audio_file.tags.get(atom) != [value]:
+                audio_file.tags[atom] = [value]
+                changed.append(field)
+        if cover_data is not None:
+            covers = audio_file.tags.get("covr") or []
+            if len(covers) != 1 or bytes(covers[0]) != cover_data:
+                audio_file.tags["covr"] = [MP4Cover(cover_data, imageformat=MP4Cover.FORMAT_JPEG)]
+                changed.append("cover")
+        if changed:
+            audio_file.save()
+    elif container == "ogg":
+        audio_file = OggOpus(path)
+        for field, value in tags.items():
+            comment = FIELD_MAP[field][2]
+            if comment is not None and audio_file.get(comment) != [value]:
+                audio_file[comment] = value
+                changed.append(field)
+        if cover_data is not None:
+            pictures = audio_file.get("METADATA_BLOCK_PICTURE") or []
+            current = Picture(base64.b64decode(pictures[0])).data if len(pictures) == 1 else None
+            if current != cover_data:
+                picture = Picture()
+                picture.data = cover_data
+                picture.type = 3
+                picture.mime = "image/jpeg"
+                audio_file["METADATA_BLOCK_PICTURE"] = [base64.b64encode(picture.write()).decode("ascii")]
+                changed.append("cover")
+        if changed:
+            audio_file.save()
+    return changed
@@ -0,0 +1,36 @@
+from backend.services.provider import ServiceProvider, normalize
+
+
+class LocalProvider(ServiceProvider):
+    """A provider backed by in-memory track lists instead of a web api, for trying the resolver offline.
+
+    `catalog` holds the searchable tracks, `playlists` maps playlist ids to track lists. Every search is
+    counted in `searches`, which shows whether a lookup was answered from the match cache.
+    """
+
+    def __init__(self, name: str = "local", catalog: list = None, playlists: dict = None):
+        self.name = name
+        self.catalog = list(catalog or [])
+        self.playlists = dict(playlists or {})
+        self.searches = 0
+
+    def iter_playlist(self, playlist_id: str = None, page_size: int = 100):
+        if playlist_id not in self.playlists:
+            raise ValueError("Playlist is unreachable!")
+        tracks = self.playlists[playlist_id]
+        for index in range(0, len(tracks), page_size):
+            yield tracks[index:index + page_size]
+
+    def search_tracks(self, query: str = None, limit: int = 5):
+        if query is None:
+            raise ValueError("No query given!")
+        self.searches += 1
+        words = set(normalize(query).split())
+        ranked = []
+        for track in self.catalog:
+            text = set(normalize(f"{track.get('title', '')} {' '.join(track.get('artists') or [])}").split())
+            overlap = len(words & text)
+            if overlap:
+                ranked.append((overlap, track))
+        ranked.sort(key=lambda i: i[0], reverse=True)
+        return [track for _, track in ranked[:limit]]
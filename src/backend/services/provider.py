@@ -0,0 +1,170 @@
+import abc
+import concurrent.futures
+import difflib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+
+# "(feat. x)", "[Official Video]", "- Remastered 2011" and similar decorations don't identify a song
+DECORATIONS = re.compile(r"[(\[][^)\]]*[)\]]|\s-\s.*(remaster|version|edit|mix|live).*$|\b(feat|ft|featuring)\b\.?.*$")
+NON_WORD = re.compile(r"[^\w\s]")
+SPACES = re.compile(r"\s+")
+MATCH_THRESHOLD = 0.75
+
+
+class ServiceProvider(abc.ABC):
+    """What a streaming service has to offer to PlaylistSync.
+
+    Tracks are dicts with at least title, artists (list), album, duration_seconds and the service's own id
+    under "<name>_id" (e.g. youtube_id), the shape YouTube.get_playlist already returns.
+    """
+    name = None
+
+    @abc.abstractmethod
+    def iter_playlist(self, playlist_id: str = None, page_size: int = 100):
+        """Yield the tracks of a playlist in pages (lists of tracks)."""
+
+    @abc.abstractmethod
+    def search_tracks(self, query: str = None, limit: int = 5):
+        """Candidate tracks for a free text query, best guess first."""
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode("ascii").lower()
+    text = DECORATIONS.sub(" ", text)
+    text = NON_WORD.sub(" ", text)
+    return SPACES.sub(" ", text).strip()
+
+
+def match_key(track: dict) -> str:
+    artists = track.get("artists") or []
+    return f"{normalize(track.get('title'))}|{normalize(artists[0]) if artists else ''}"
+
+
+def seconds(value) -> int:
+    """Durations come as ints or as "m:ss"/"h:mm:ss" strings depending on the api call."""
+    if isinstance(value, str):
+        total = 0
+        for part in value.split(":"):
+            total = total * 60 + int(part or 0)
+        return total
+    return int(value or 0)
+
+
+def score(source: dict, candidate: dict) -> float:
+    """0..1 similarity of two tracks from title, artists and duration."""
+    title = difflib.SequenceMatcher(None, normalize(source.get("title")), normalize(candidate.get("title"))).ratio()
+    source_artists = {normalize(i) for i in source.get("artists") or []}
+    candidate_artists = {normalize(i) for i in candidate.get("artists") or []}
+    artist = len(source_artists & candidate_artists) / len(source_artists) if source_artists else 0.5
+    duration = 1.0
+    if source.get("duration_seconds") and candidate.get("duration_seconds"):
+        difference = abs(seconds(source["duration_seconds"]) - seconds(candidate["duration_seconds"]))
+        duration = 1.0 if difference <= 3 else max(0.0, 1 - (difference - 3) / 30)
+    return 0.5 * title + 0.3 * artist + 0.2 * duration
+
+
+class TrackResolver:
+    """Maps tracks of another service to tracks of the target provider (YouTube, which download_track can fetch).
+
+    Lookups run concurrently and every answer, misses included, lands in a persistent json cache keyed by the
+    source track id and by the normalized title/artist, so no track is ever searched twice.
+    """
+
+    def __init__(self, target: ServiceProvider = None, cache_file: str = None, max_workers: int = 8):
+        if target is None:
+            raise ValueError("No target provider was given!")
+        if cache_file is None:
+            raise ValueError("No cache file was given!")
+        self.target = target
+        self.cache_file = cache_file
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._cache = {"ids": {}, "keys": {}}
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    self._cache = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                print("Match cache corrupted! Starting with an empty one")
+
+    def _save(self) -> None:
+        dirpath = os.path.dirname(os.path.abspath(self.cache_file))
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=dirpath)
+        try:
+            with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
+                json.dump(self._cache, f, separators=(",", ":"))
+            os.replace(tmp_path, self.cache_file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def cached(self, source_id: str):
+        """(found, target id) for a source track id."""
+        with self._lock:
+            if source_id in self._cache["ids"]:
+                return True, self._cache["ids"][source_id]["id"]
+        return False, None
+
+    def _lookup(self, track: dict):
+        artists = track.get("artists") or []
+        query = f"{track.get('title', '')} {artists[0] if artists else ''}".strip()
+        best, best_score = None, 0.0
+        for candidate in self.target.search_tracks(query=query, limit=5):
+            candidate_score = score(track, candidate)
+            if candidate_score > best_score:
+                best, best_score = candidate, candidate_score
+        if best is None or best_score < MATCH_THRESHOLD:
+            return None, best_score
+        return best[f"{self.target.name}_id"], best_score
+
+    def resolve(self, tracks: dict = None) -> dict:
+        """Resolve {source track id: track} to {source track id: target id or None}."""
+        results, pending = {}, {}
+        with self._lock:
+            for source_id, track in (tracks or {}).items():
+                if source_id in self._cache["ids"]:
+                    results[source_id] = self._cache["ids"][source_id]["id"]
+                    continue
+                key = match_key(track)
+                if key in self._cache["keys"]:
+                    results[source_id] = self._cache["keys"][key]["id"]
+                    self._cache["ids"][source_id] = self._cache["keys"][key]
+                    continue
+                # The same song listed twice (or on two services) is only searched once
+                pending.setdefault(key, (track, []))[1].append(source_id)
+
+        if pending:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._lookup, track): key for key, (track, _) in pending.items()}
+                for future in concurrent.futures.as_completed(futures):
+                    key = futures[future]
+                    try:
+                        target_id, match_score = future.result()
+                    except Exception as e:
+                        # Failed lookups aren't cached, they are retried next time
+                        print(f"Resolving {key} failed: {e}")
+                        for source_id in pending[key][1]:
+                            results[source_id] = None
+                        continue
+                    entry = {"id": target_id, "score": round(match_score, 3), "resolvedOn": time.time()}
+                    with self._lock:
+                        self._cache["keys"][key] = entry
+                        for source_id in pending[key][1]:
+                            self._cache["ids"][source_id] = entry
+                            results[source_id] = target_id
+            with self._lock:
+                self._save()
+        return results
+
+    def forget(self, source_id: str = None) -> None:
+        """Drop a (wrong) match so the track is resolved again."""
+        with self._lock:
+            entry = self._cache["ids"].pop(source_id, None)
+            if entry is not None:
+                self._cache["keys"] = {key: value for key, value in self._cache["keys"].items() if value != entry}
+                self._save()
@@ -1,7 +1,14 @@
 import yt_dlp
 import ytmusicapi
+from ytmusicapi.continuations import CONTINUATION_ITEMS, get_continuation_token
+from ytmusicapi.navigation import CONTENT, SECTION, TWO_COLUMN_RENDERER, nav
+from ytmusicapi.parsers.playlists import parse_playlist_items
 import ping3
 import re
+from backend.services.provider import ServiceProvider
+
+STREAMABLE_PROTOCOLS = {"http", "https"}
+STREAMABLE_EXTS = {"webm", "weba", "ogg", "opus", "mp3"}
 
 def check_network():
     is_online = ping3.ping("1.1.1.1")
@@ -10,9 +17,17 @@ def check_network():
 def sanitize(s):
     return re.sub(r'[<>:"/\\|?*\']', '', s)
 
-class YouTube():
-    def __init__(self):
+class YouTube(ServiceProvider):
+    name = "youtube"
+
+    def __init__(self, governor=None):
         self.yt_music_api = ytmusicapi.YTMusic()
+        # backend.governor.Governor shared with the other download paths, None means unlimited
+        self.governor = governor
+
+    def _request(self):
+        if self.governor is not None:
+            self.governor.request()
 
     def download_track(self, youtube_id: str = None, download_folder: str = None,progress_hook:callable = None):
         if not check_network():
@@ -28,38 +43,75 @@ class YouTube():
             'outtmpl': f"{download_folder}/{youtube_id}.%(ext)s",
             'quiet': True,
         }
+        hooks = [progress_hook] if progress_hook is not None else []
+        if self.governor is not None:
+            hooks.append(self.governor.progress_hook())
+        if hooks:
+            ydl_config['progress_hooks'] = hooks
         try:
+            self._request()
             with yt_dlp.YoutubeDL(ydl_config) as ydl:
                 info = ydl.extract_info(f"https://music.youtube.com/watch?v={youtube_id}")
 
-            audio_file = info["requested_downloads"][0]["filepath"]
-            title = sanitize(info.get('title', "Unknown Title"))
-            artist_list = info.get('artists', [info.get('uploader', "Unknown Artist")])
-            artist_str = sanitize(", ".join(artist_list))
-            album = sanitize(info.get('album', "Unknown Album"))
-            release_year = info.get('release_year') or int(info.get('upload_date', "20000000")[0:4] or 0)
-            length = info.get('duration', 200)
-            covers = info.get('thumbnails')
-            if not covers[2].get('height', 1) == covers[2].get('width', 0):
-                cover_url = info.get('thumbnail')
-            else:
-                cover_url = covers[2]["url"]
-
-            return {
-                "id": id,
-                "title": title,
-                "artists": artist_list,
-                "artist":artist_str,
-                "album": album,
-                "release": release_year,
-                "length": length,
-                "cover_url": cover_url,
-                "file_path": audio_file,
-            }
+            return_dict = self._parse_track_info(youtube_id, info)
+            return_dict["file_path"] = info["requested_downloads"][0]["filepath"]
+            return return_dict
 
         except Exception as e:
             raise e
 
+    def get_stream(self, youtube_id: str = None):
+        """Resolve a track without downloading it. Besides the metadata the result holds the direct media url
+        and whether ffmpeg can read the format from a pipe."""
+        if not check_network():
+            raise ConnectionError("No internet connection!")
+        if youtube_id is None:
+            raise ValueError("No youtube id given!")
+        ydl_config = {
+            # webm/opus is streamable, m4a usually has its index at the end and needs a seekable file
+            'format': "bestaudio[ext=webm]/bestaudio/best",
+            'quiet': True,
+        }
+        self._request()
+        with yt_dlp.YoutubeDL(ydl_config) as ydl:
+            info = ydl.extract_info(f"https://music.youtube.com/watch?v={youtube_id}", download=False)
+
+        return_dict = self._parse_track_info(youtube_id, info)
+        return_dict["stream"] = {
+            "url": info.get("url"),
+            "headers": info.get("http_headers", {}),
+            "ext": info.get("ext"),
+            "size": info.get("filesize") or info.get("filesize_approx"),
+            "streamable": info.get("url") is not None and info.get("protocol") in STREAMABLE_PROTOCOLS
+                          and info.get("ext") in STREAMABLE_EXTS,
+        }
+        return return_dict
+
+    @staticmethod
+    def _parse_track_info(youtube_id: str, info: dict):
+        title = sanitize(info.get('title', "Unknown Title"))
+        artist_list = info.get('artists', [info.get('uploader', "Unknown Artist")])
+        artist_str = sanitize(", ".join(artist_list))
+        album = sanitize(info.get('album', "Unknown Album"))
+        release_year = info.get('release_year') or int(info.get('upload_date', "20000000")[0:4] or 0)
+        length = info.get('duration', 200)
+        covers = info.get('thumbnails')
+        if not covers[2].get('height', 1) == covers[2].get('width', 0):
+            cover_url = info.get('thumbnail')
+        else:
+            cover_url = covers[2]["url"]
+
+        return {
+            "id": youtube_id,
+            "title": title,
+            "artists": artist_list,
+            "artist":artist_str,
+            "album": album,
+            "release": release_year,
+            "length": length,
+            "cover_url": cover_url,
+        }
+
     def get_playlist(self, youtube_id: str = None):
         if not check_network():
             raise ConnectionError("No internet connection!")
@@ -69,28 +121,11 @@ class YouTube():
             ValueError("Invalid youtube id given!")
 
         try:
+            self._request()
             data = self.yt_music_api.get_playlist(playlistId=youtube_id, limit=None)
             return_dict = {}
 
-            return_dict["tracks"] = []
-            for track in data["tracks"]:
-                print(track)
-                try:
-                    track_dict = {}
-                    track_dict["title"] = track.get("title", "Unknown title")
-                    track_dict["artists"] = [i.get("name", "Unknown artist") for i in track.get("artists")] if track.get(
-                        "artists") is not None else ["Unknown artist"]
-
-                    track_dict["album"] = track.get("album", {}).get("name", "Unknown album") if not track["album"] is None else "Unknown album"
-
-                    track_dict["duration_seconds"] = track.get("duration", 0)
-                    track_dict["thumbnail"] = track.get("thumbnails")[0]["url"].split("=")[0] + "=w600-h600" if track.get(
-                        "thumbnails") is not None else None
-                    track_dict["youtube_id"] = track["videoId"]
-                    return_dict["tracks"].append(track_dict)
-
-                except Exception as e:
-                    print(e)
+            return_dict["tracks"] = self._parse_playlist_tracks(data["tracks"])
             try:
                 return_dict["title"] = data.get("title", "Unknwon Title")
                 return_dict["thumbnail"] = data.get("thumbnails", [])[-1].get("url", None)
@@ -100,4 +135,80 @@ class YouTube():
             return return_dict
 
         except Exception as e:
-            raise ValueError("Playlist is unreachable! Most likely caused by a playlist that is private! Set it to link only or public!")
\ No newline at end of file
+            raise ValueError("Playlist is unreachable! Most likely caused by a playlist that is private! Set it to link only or public!")
+
+    def iter_playlist(self, playlist_id: str = None, page_size: int = 100):
+        """Yield the tracks of a playlist page by page, so the caller can start working on the first page
+        while the rest is still being fetched. Tracks have the same shape as in get_playlist."""
+        if not check_network():
+            raise ConnectionError("No internet connection!")
+        if playlist_id is None:
+            raise ValueError("No youtube id given!")
+
+        # get_playlist only returns after following every continuation, so the browse responses are requested
+        # here one by one (the same requests and parsers get_playlist uses) and every page is yielded right away
+        browse_id = playlist_id if playlist_id.startswith("VL") else "VL" + playlist_id
+        try:
+            self._request()
+            response = self.yt_music_api._send_request("browse", {"browseId": browse_id})
+        except Exception as e:
+            raise ValueError("Playlist is unreachable! Most likely caused by a playlist that is private! Set it to link only or public!")
+        shelf = nav(response, [*TWO_COLUMN_RENDERER, "secondaryContents", *SECTION, *CONTENT, "musicPlaylistShelfRenderer"], True)
+        if shelf is None:
+            # Layouts without a playlist shelf (e.g. album playlists) come from one full listing
+            tracks = self.get_playlist(youtube_id=playlist_id)["tracks"]
+            for index in range(0, len(tracks), page_size):
+                yield tracks[index:index + page_size]
+            return
+
+        pending = []
+        contents = shelf.get("contents", [])
+        while contents:
+            pending.extend(self._parse_playlist_tracks(parse_playlist_items(contents)))
+            while len(pending) >= page_size:
+                yield pending[:page_size]
+                pending = pending[page_size:]
+            token = get_continuation_token(contents)
+            if not token:
+                break
+            self._request()
+            response = self.yt_music_api._send_request("browse", {"continuation": token})
+            contents = nav(response, CONTINUATION_ITEMS, True) or []
+        if pending:
+            yield pending
+
+    def search_tracks(self, query: str = None, limit: int = 5):
+        """Songs matching a free text query, in the same shape as playlist tracks."""
+        if not check_network():
+            raise ConnectionError("No internet connection!")
+        if query is None:
+            raise ValueError("No query given!")
+        self._request()
+        results = self.yt_music_api.search(query, filter="songs", limit=limit)
+        for result in results:
+            result.setdefault("album", None)
+            # Search results have the length as "m:ss" in duration and as int in duration_seconds
+            result["duration"] = result.get("duration_seconds", 0)
+        return self._parse_playlist_tracks([result for result in results if result.get("videoId")])[:limit]
+
+    @staticmethod
+    def _parse_playlist_tracks(tracks: list):
+        return_list = []
+        for track in tracks:
+            try:
+                track_dict = {}
+                track_dict["title"] = track.get("title", "Unknown title")
+                track_dict["artists"] = [i.get("name", "Unknown artist") for i in track.get("artists")] if track.get(
+                    "artists") is not None else ["Unknown artist"]
+
+                track_dict["album"] = track.get("album", {}).get("name", "Unknown album") if not track["album"] is None else "Unknown album"
+
+                track_dict["duration_seconds"] = track.get("duration", 0)
+                track_dict["thumbnail"] = track.get("thumbnails")[0]["url"].split("=")[0] + "=w600-h600" if track.get(
+                    "thumbnails") is not None else None
+                track_dict["youtube_id"] = track["videoId"]
+                return_list.append(track_dict)
+
+            except Exception as e:
+                print(e)
+        return return_list
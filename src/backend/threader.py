@@ -11,10 +11,15 @@ class WorkerThread(threading.Thread):
         super().__init__(daemon=daemon)
         self.job_queue = job_queue
         self.id = uuid.uuid4()
+        self.stop_event = threading.Event()
+
+    def stop(self) -> None:
+        """Ask the worker to exit once its current job (if any) is finished."""
+        self.stop_event.set()
 
     def run(self) -> None:
-        """Continuously fetch and execute jobs until the main program exits."""
-        while True:
+        """Continuously fetch and execute jobs until the worker is stopped or the main program exits."""
+        while not self.stop_event.is_set():
             try:
                 # wait for a job; block only for a short time so we can be responsive
                 job = self.job_queue.get(timeout=SEC_PER_CHECK)
@@ -25,6 +30,9 @@ class WorkerThread(threading.Thread):
             try:
                 job()  # Execute the callable
                 print(f"{self.id} completed a job")
+            except Exception as e:
+                # A failing job must not take the worker down with it
+                print(f"{self.id} failed a job: {e}")
             finally:
                 # Tell the queue that the job is done (important for `queue.join()`)
                 self.job_queue.task_done()
@@ -35,11 +43,32 @@ class QueueSystem:
     def __init__(self, max_threads: int = 4):
         self.job_queue = queue.Queue()
         self.workers = []
+        self._lock = threading.Lock()
+        self.resize(max_threads)
+
+    @property
+    def max_threads(self) -> int:
+        return len(self.workers)
+
+    def resize(self, max_threads: int):
+        """Grow or shrink the pool in place. Stopped workers finish their running job first."""
+        if max_threads < 1:
+            raise ValueError("The pool needs at least one worker!")
+        with self._lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive() and not worker.stop_event.is_set()]
+            while len(self.workers) < max_threads:
+                worker = WorkerThread(self.job_queue)
+                worker.start()
+                self.workers.append(worker)
+            while len(self.workers) > max_threads:
+                self.workers.pop().stop()
 
-        for _ in range(max_threads):
-            worker = WorkerThread(self.job_queue)
-            worker.start()
-            self.workers.append(worker)
+    def shutdown(self):
+        """Stop every worker. Queued jobs stay in the queue."""
+        with self._lock:
+            for worker in self.workers:
+                worker.stop()
+            self.workers = []
 
     def submit_jobs(self, jobs: list):
         """Enqueue a list of callables to be executed by the pool."""
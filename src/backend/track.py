@@ -0,0 +1,124 @@
+import sys
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Iterator, Optional
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _pack_hash(value: Any) -> Any:
+    """Store md5 hex digests as 16 raw bytes instead of a 32 character string."""
+    if isinstance(value, str) and len(value) == 32:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _unpack_hash(value: Any) -> Any:
+    return value.hex() if isinstance(value, bytes) else value
+
+
+class _Record(MutableMapping):
+    """Slotted mapping with a fixed set of fields. Unknown keys go to a lazily created dict."""
+    __slots__ = ()
+    FIELDS: tuple[str, ...] = ()
+    INTERNED: frozenset[str] = frozenset()
+    HASHES: frozenset[str] = frozenset()
+
+    def __init__(self, data: Optional[Mapping] = None) -> None:
+        self.extra = None
+        if data:
+            self.update(data)
+
+    def _pack(self, key: str, value: Any) -> Any:
+        if key in self.HASHES:
+            return _pack_hash(value)
+        if key in self.INTERNED:
+            return _intern(value)
+        return value
+
+    def _unpack(self, key: str, value: Any) -> Any:
+        if key in self.HASHES:
+            return _unpack_hash(value)
+        return value
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            try:
+                return self._unpack(key, getattr(self, key))
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self.FIELDS:
+            setattr(self, key, self._pack(key, value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self.FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        else:
+            if self.extra is None:
+                raise KeyError(key)
+            del self.extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self) -> dict[str, Any]:
+        """Plain (json serializable) dict copy of the record."""
+        out = {}
+        for key in self:
+            value = self[key]
+            out[key] = value.to_dict() if isinstance(value, _Record) else value
+        return out
+
+
+class FileInfo(_Record):
+    FIELDS = ("cover_url", "cover_mode", "cover_hash", "media_container", "media_bitrate", "media_hash", "media_file", "length", "tag_fingerprint", "tag_stamp",
+              "loudness_integrated", "loudness_true_peak", "replaygain_track_gain")
+    INTERNED = frozenset({"cover_mode", "media_container", "media_bitrate"})
+    HASHES = frozenset({"cover_hash", "media_hash", "tag_fingerprint"})
+    __slots__ = FIELDS + ("extra",)
+
+
+class TrackRecord(_Record):
+    """Compact in-memory representation of a library track, usable wherever the old track dict was."""
+    FIELDS = ("playlist_id", "track_id", "title", "artist", "album", "release", "success", "file_info", "unavailable_reason", "unavailable_until",
+              "removed_upstream", "upstream_metadata")
+    INTERNED = frozenset({"playlist_id", "track_id", "album", "unavailable_reason"})
+    __slots__ = FIELDS + ("extra",)
+
+    def _pack(self, key: str, value: Any) -> Any:
+        if key == "artist" and isinstance(value, (list, tuple)):
+            return tuple(_intern(i) for i in value)
+        if key == "file_info" and isinstance(value, Mapping) and not isinstance(value, FileInfo):
+            return FileInfo(value)
+        return super()._pack(key, value)
+
+    def _unpack(self, key: str, value: Any) -> Any:
+        if key == "artist" and isinstance(value, tuple):
+            return list(value)
+        return super()._unpack(key, value)
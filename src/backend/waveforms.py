@@ -0,0 +1,121 @@
+import os
+import re
+import struct
+import tempfile
+from typing import Optional
+import numpy as np
+import imageio_ffmpeg as ffmpeg
+import backend.helper_functions as helper_functions
+
+MAGIC = b"PSWF"
+VERSION = 1
+# magic, version, peaks per second, peak count
+HEADER = struct.Struct("<4sBHI")
+PEAKS_PER_SECOND = 20
+
+
+class PeakAccumulator:
+    """Reduces mono 16 bit pcm (as helper_functions.pcm_output_args produces it) to one peak per block while it streams in."""
+
+    def __init__(self, sample_rate: int = helper_functions.PCM_SAMPLE_RATE, peaks_per_second: int = PEAKS_PER_SECOND):
+        self.peaks_per_second = peaks_per_second
+        self.block = max(1, sample_rate // peaks_per_second)
+        self._rest = b""
+        self._peaks = []
+
+    def feed(self, chunk: bytes) -> None:
+        data = self._rest + chunk
+        usable = len(data) // (2 * self.block) * 2 * self.block
+        self._rest = data[usable:]
+        if usable:
+            samples = np.frombuffer(data[:usable], dtype="<i2").reshape(-1, self.block)
+            self._peaks.append(np.abs(samples.astype(np.int32)).max(axis=1))
+
+    def finish(self) -> np.ndarray:
+        """Peaks scaled to 0..255."""
+        if len(self._rest) >= 2:
+            samples = np.frombuffer(self._rest[:len(self._rest) // 2 * 2], dtype="<i2")
+            self._peaks.append(np.array([np.abs(samples.astype(np.int32)).max()]))
+            self._rest = b""
+        if not self._peaks:
+            return np.zeros(0, dtype=np.uint8)
+        peaks = np.concatenate(self._peaks)
+        return np.minimum(peaks * 256 // 32768, 255).astype(np.uint8)
+
+
+def encode(peaks: np.ndarray, peaks_per_second: int = PEAKS_PER_SECOND) -> bytes:
+    peaks = np.asarray(peaks, dtype=np.uint8)
+    return HEADER.pack(MAGIC, VERSION, peaks_per_second, len(peaks)) + peaks.tobytes()
+
+
+def decode(data: bytes):
+    """(peaks per second, uint8 peaks) from encode()d bytes."""
+    magic, version, peaks_per_second, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a waveform file!")
+    peaks = np.frombuffer(data, dtype=np.uint8, count=count, offset=HEADER.size)
+    return peaks_per_second, peaks
+
+
+def downsample(peaks: np.ndarray, width: int = None) -> np.ndarray:
+    """Reduce peaks to `width` columns for drawing, keeping the maximum of every column."""
+    if width is None or len(peaks) <= width:
+        return peaks
+    edges = np.linspace(0, len(peaks), width + 1).astype(np.int64)
+    return np.maximum.reduceat(peaks, edges[:-1])
+
+
+def analyze_file(input_file: str = None) -> np.ndarray:
+    """Peaks of an existing audio file, for files downloaded before waveforms were generated."""
+    if input_file is None or not os.path.exists(input_file):
+        raise FileNotFoundError("Unable to find the input file!")
+    accumulator = PeakAccumulator()
+    command = [ffmpeg.get_ffmpeg_exe(), '-loglevel', 'quiet', '-hide_banner', '-nostats', '-i', input_file] + helper_functions.pcm_output_args()
+    helper_functions._run_piped(command, None, pcm_sink=accumulator.feed)
+    return accumulator.finish()
+
+
+class WaveformStore:
+    """Peak files of tracks in <cache_path>/waveforms, one <track id>.peaks file per track."""
+
+    def __init__(self, cache_path: str = None):
+        if cache_path is None:
+            raise ValueError("No cache path was given!")
+        self.folder = os.path.join(cache_path, "waveforms")
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _file(self, track_id: str) -> str:
+        return os.path.join(self.folder, re.sub(r"[^A-Za-z0-9_-]", "_", track_id) + ".peaks")
+
+    def has(self, track_id: str = None) -> bool:
+        return bool(track_id) and os.path.exists(self._file(track_id))
+
+    def write(self, track_id: str = None, peaks: np.ndarray = None, peaks_per_second: int = PEAKS_PER_SECOND) -> None:
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=self.folder)
+        try:
+            with os.fdopen(tmp_fd, "wb") as f:
+                f.write(encode(peaks, peaks_per_second))
+            os.replace(tmp_path, self._file(track_id))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def read(self, track_id: str = None, width: int = None) -> Optional[tuple]:
+        """(peaks per second, peaks) of a track, downsampled to `width` columns if given, or None."""
+        if not self.has(track_id):
+            return None
+        with open(self._file(track_id), "rb") as f:
+            peaks_per_second, peaks = decode(f.read())
+        reduced = downsample(peaks, width)
+        if len(reduced) != len(peaks):
+            peaks_per_second = peaks_per_second * len(reduced) / len(peaks)
+        return peaks_per_second, reduced
+
+    def orphans(self, track_ids) -> list:
+        """Peak files that belong to none of the given tracks."""
+        expected = {os.path.basename(self._file(track_id)) for track_id in track_ids}
+        return [os.path.join(self.folder, f) for f in os.listdir(self.folder) if f.endswith(".peaks") and f not in expected]
+
+    def remove(self, track_id: str = None) -> None:
+        if self.has(track_id):
+            os.remove(self._file(track_id))
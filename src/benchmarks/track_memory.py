@@ -0,0 +1,66 @@
+"""Memory benchmark of plain track dicts vs TrackRecord on a synthetic library.
+
+Run from the src folder: python -m benchmarks.track_memory [track_count]
+"""
+import json
+import random
+import string
+import sys
+import tracemalloc
+
+from backend.track import TrackRecord
+
+PLAYLIST_COUNT = 20
+
+
+def synthetic_tracks(count: int):
+    rng = random.Random(0)
+    artists = ["Artist " + "".join(rng.choices(string.ascii_letters, k=8)) for _ in range(count // 20 + 1)]
+    albums = ["Album " + "".join(rng.choices(string.ascii_letters, k=10)) for _ in range(count // 10 + 1)]
+    for i in range(count):
+        youtube_id = "".join(rng.choices(string.ascii_letters + string.digits + "-_", k=11))
+        yield {
+            "success": True,
+            "title": "Title " + "".join(rng.choices(string.ascii_letters, k=16)),
+            "artist": rng.sample(artists, k=rng.randint(1, 3)),
+            "album": rng.choice(albums),
+            "release": rng.randint(1960, 2025),
+            "track_id": f"youtube:track:{youtube_id}",
+            "playlist_id": f"youtube:playlist:PL{i % PLAYLIST_COUNT:032d}",
+            "file_info": {
+                "cover_url": f"https://lh3.googleusercontent.com/{youtube_id}=w600-h600",
+                "cover_mode": "crop",
+                "cover_hash": "%032x" % rng.getrandbits(128),
+                "media_container": "mp3",
+                "media_bitrate": "256k",
+                "media_hash": "%032x" % rng.getrandbits(128),
+                "length": rng.randint(60, 600),
+            },
+        }
+
+
+def measure(count: int, compact: bool) -> int:
+    # Tracks are round-tripped through json so every string is a separate object, like after loading a shard
+    raw = json.dumps(list(synthetic_tracks(count)))
+    tracemalloc.start()
+    tracks = json.loads(raw)
+    if compact:
+        tracks = [TrackRecord(i) for i in tracks]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tracks
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    plain = measure(count, compact=False)
+    compact = measure(count, compact=True)
+    print(f"{count} tracks")
+    print(f"dict:        {plain / 2 ** 20:8.1f} MiB ({plain / count:6.0f} B/track)")
+    print(f"TrackRecord: {compact / 2 ** 20:8.1f} MiB ({compact / count:6.0f} B/track)")
+    print(f"saved:       {(1 - compact / plain) * 100:8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import contextlib
+import json
+import signal
+import sys
+import threading
+import time
+
+import backend.functions as backend
+
+EXIT_OK = 0
+EXIT_FAILED_TRACKS = 1
+EXIT_ERROR = 2
+EXIT_NO_NETWORK = 3
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="playlistsync", description="Headless PlaylistSync (no GUI needed)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker threads, overrides max_threads from config.json")
+    parser.add_argument("--json", action="store_true", help="print machine readable json to stdout")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync = commands.add_parser("sync", help="download missing tracks of playlists")
+    sync.add_argument("playlists", nargs="*", help="library ids, e.g. youtube:playlist:<id>")
+    sync.add_argument("--all", action="store_true", help="sync every playlist in the library")
+
+    verify = commands.add_parser("verify", help="check that downloaded tracks still exist on disk")
+    verify.add_argument("--repair", action="store_true", help="mark missing tracks for download on the next sync")
+
+    add = commands.add_parser("add", help="add a playlist to the library")
+    add.add_argument("url", help="playlist url")
+    add.add_argument("--sync", action="store_true", help="sync the playlist right away")
+
+    commands.add_parser("stats", help="library statistics")
+
+    relayout = commands.add_parser("relayout", help="rename files and folders after filename_template or folder_name changed")
+    relayout.add_argument("playlists", nargs="*", help="library ids, e.g. youtube:playlist:<id>")
+    relayout.add_argument("--all", action="store_true", help="re-layout every playlist in the library")
+    relayout.add_argument("--dry-run", action="store_true", help="only print the planned renames")
+
+    migrate = commands.add_parser("migrate", help="re-encode downloaded tracks to the configured codec/quality")
+    migrate.add_argument("playlists", nargs="*", help="library ids, e.g. youtube:playlist:<id>")
+    migrate.add_argument("--all", action="store_true", help="migrate every playlist in the library")
+    migrate.add_argument("--processes", type=int, default=None, help="encoder processes (default: cpu count)")
+
+    retag = commands.add_parser("retag", help="rewrite file tags that differ from the library metadata")
+    retag.add_argument("playlists", nargs="*", help="library ids, e.g. youtube:playlist:<id>")
+    retag.add_argument("--all", action="store_true", help="retag every playlist in the library")
+    retag.add_argument("--no-covers", action="store_true", help="leave embedded covers alone")
+    retag.add_argument("--force", action="store_true", help="open every file, even unchanged ones")
+
+    waveforms = commands.add_parser("waveforms", help="generate missing waveform peak files of downloaded tracks")
+    waveforms.add_argument("playlists", nargs="*", help="library ids, e.g. youtube:playlist:<id>")
+    waveforms.add_argument("--all", action="store_true", help="every playlist in the library")
+    waveforms.add_argument("--force", action="store_true", help="regenerate existing peak files too")
+
+    commands.add_parser("gc", help="remove stale temp files, evict covers over cache_budget_mb and drop orphaned waveforms")
+
+    daemon = commands.add_parser("daemon", help="re-sync every playlist on a schedule")
+    daemon.add_argument("--interval", type=float, default=3600, help="seconds between syncs (default: 3600)")
+    return parser
+
+
+def sync_playlists(backendInstance, playlist_ids):
+    results, exit_code = {}, EXIT_OK
+    for playlist_id in playlist_ids:
+        try:
+            results[playlist_id] = backendInstance.sync_playlist(library_uri=playlist_id)
+            if results[playlist_id]["failed"]:
+                exit_code = max(exit_code, EXIT_FAILED_TRACKS)
+        except ConnectionError as e:
+            results[playlist_id] = {"error": str(e)}
+            exit_code = max(exit_code, EXIT_NO_NETWORK)
+        except Exception as e:
+            results[playlist_id] = {"error": str(e)}
+            exit_code = max(exit_code, EXIT_ERROR)
+    return results, exit_code
+
+
+def run_daemon(backendInstance, interval, report, jobs=None):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    backendInstance.garbageCollector.start()
+    while not stop.is_set():
+        started = time.time()
+        # The backend (and with it the library, caches and worker pool) stays alive between runs
+        backendInstance.reload_config(max_threads=jobs)
+        results, exit_code = sync_playlists(backendInstance, backendInstance.libraryInstance.get_playlists())
+        report({"started": started, "finished": time.time(), "exit_code": exit_code, "playlists": results})
+        stop.wait(max(0.0, interval - (time.time() - started)))
+    backendInstance.garbageCollector.stop()
+    return EXIT_OK
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+
+    def report(data):
+        if args.json:
+            print(json.dumps(data), file=out, flush=True)
+        else:
+            print(json.dumps(data, indent=4), file=out, flush=True)
+
+    # Backend chatter goes to stderr so --json output stays parseable
+    with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+        backendInstance = backend.Backend()
+        if args.jobs is not None:
+            backendInstance.threadingInstance.resize(args.jobs)
+
+        if args.command in ["sync", "relayout", "migrate", "retag", "waveforms"]:
+            if args.all:
+                playlist_ids = backendInstance.libraryInstance.get_playlists()
+            elif args.playlists:
+                playlist_ids = args.playlists
+            else:
+                print("Give playlist ids or --all!", file=sys.stderr)
+                return EXIT_ERROR
+        if args.command == "relayout":
+            results, exit_code = {}, EXIT_OK
+            for playlist_id in playlist_ids:
+                try:
+                    results[playlist_id] = backendInstance.relayout_playlist(library_uri=playlist_id, dry_run=args.dry_run)
+                except Exception as e:
+                    results[playlist_id] = {"error": str(e)}
+                    exit_code = EXIT_ERROR
+            report(results)
+            return exit_code
+        if args.command == "migrate":
+            results = backendInstance.migrate_codec(playlist_ids=playlist_ids, processes=args.processes)
+            report(results)
+            return EXIT_FAILED_TRACKS if results["failed"] else EXIT_OK
+        if args.command == "retag":
+            results = backendInstance.retag_library(playlist_ids=playlist_ids, covers=not args.no_covers, workers=args.jobs, force=args.force)
+            report(results)
+            return EXIT_FAILED_TRACKS if results["failed"] else EXIT_OK
+        if args.command == "waveforms":
+            results = backendInstance.backfill_waveforms(playlist_ids=playlist_ids, workers=args.jobs, force=args.force)
+            report(results)
+            return EXIT_FAILED_TRACKS if results["failed"] else EXIT_OK
+        if args.command == "sync":
+            results, exit_code = sync_playlists(backendInstance, playlist_ids)
+            report(results)
+            return exit_code
+        if args.command == "verify":
+            results = backendInstance.verify_library(repair=args.repair)
+            report(results)
+            return EXIT_FAILED_TRACKS if any(i["missing"] for i in results.values()) else EXIT_OK
+        if args.command == "add":
+            try:
+                playlist_id = backendInstance.add_playlist_to_library(playlist_url=args.url)
+            except ConnectionError as e:
+                report({"error": str(e)})
+                return EXIT_NO_NETWORK
+            except ValueError as e:
+                report({"error": str(e)})
+                return EXIT_ERROR
+            if playlist_id is None:
+                report({"error": "Unsupported playlist url"})
+                return EXIT_ERROR
+            if args.sync:
+                results, exit_code = sync_playlists(backendInstance, [playlist_id])
+                report({"id": playlist_id, "sync": results[playlist_id]})
+                return exit_code
+            report({"id": playlist_id})
+            return EXIT_OK
+        if args.command == "gc":
+            report(backendInstance.garbageCollector.collect())
+            return EXIT_OK
+        if args.command == "stats":
+            report(backendInstance.get_stats())
+            return EXIT_OK
+        if args.command == "daemon":
+            return run_daemon(backendInstance, args.interval, report, jobs=args.jobs)
+    return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,5 @@
 import gui.ui as ui
 import backend.functions as backend
-import backend.library as library
 import backend.config as config
 import sys
 from PyQt6.QtWidgets import QApplication
@@ -37,8 +36,10 @@ def set_dark_mode(app):
 
 def main():
     backendInstance = backend.Backend()
+    backendInstance.garbageCollector.start()
     configInstance = config.Config()
-    libraryInstance = library.Library(filepath=configInstance.get("download_settings",{}).get("download_path","./Music"))
+    # The gui shares the backend's library, it is the only writer of the library files
+    libraryInstance = backendInstance.libraryInstance
     app = QApplication(sys.argv)
     app.setFont(QFont("JetBrainsMonoNL NF", 10, QFont.Weight.Normal))
     set_dark_mode(app)